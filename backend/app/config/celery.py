@@ -18,14 +18,37 @@ app.autodiscover_tasks()
 
 
 app.conf.beat_schedule = {
-    'run-cleanup-every-30-seconds': {
+    # removals and mails are ETA jobs, scheduled on creation, on
+    # prolonging and by this job (see server.tasks.SCHEDULE_HORIZON)
+    'schedule-due-jobs-every-20-minutes': {
+        'task': 'schedule-due-jobs',
+        'schedule': 20 * 60.0,
+        'args': (),
+    },
+    # safety nets, ie. for ETA jobs lost with their worker
+    'run-cleanup-every-hour': {
         'task': 'remove-due-servers',
-        'schedule': 30.0,
+        'schedule': 60 * 60.0,
         'args': (),
     },
-    'send-emails-every-30-seconds': {
+    'send-emails-every-hour': {
         'task': 'send-soon-due-mails',
-        'schedule': 30.0,
+        'schedule': 60 * 60.0,
+        'args': (),
+    },
+    'top-up-warm-pools-every-5-minutes': {
+        'task': 'top-up-warm-pools',
+        'schedule': 5 * 60.0,
+        'args': (),
+    },
+    'prune-execution-messages-every-day': {
+        'task': 'prune-execution-messages',
+        'schedule': 24 * 60 * 60.0,
+        'args': (),
+    },
+    'sync-server-states-every-5-minutes': {
+        'task': 'sync-server-states',
+        'schedule': 5 * 60.0,
         'args': (),
     },
 }
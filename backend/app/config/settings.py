@@ -96,6 +96,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'core.context_processors.user_messages_push',
             ],
         },
     },
@@ -298,11 +299,27 @@ DATA_UPLOAD_MAX_NUMBER_FIELDS = env.int(
     'DATA_UPLOAD_MAX_NUMBER_FIELDS', default=12000
 )
 
+# execution messages older than this are removed by the
+# prune-execution-messages task. 0 keeps them forever.
+EXECUTION_MESSAGES_RETENTION_DAYS = env.int(
+    'DJANGO_EXECUTION_MESSAGES_RETENTION_DAYS', default=0
+)
+# if set, removed execution messages are written to gzipped jsonl files
+# in this directory
+EXECUTION_MESSAGES_ARCHIVE_DIR = env.str(
+    'DJANGO_EXECUTION_MESSAGES_ARCHIVE_DIR', default=''
+)
+
 SILENCED_SYSTEM_CHECKS = [
     #  See https://django-user-messages.readthedocs.io/en/latest/: user_messages.context_processors.messages
     'admin.E404',
 ]
 
+# push user messages through server-sent events instead of polling.
+# Only enable this when served through the ASGI application (config.asgi),
+# under WSGI every open stream blocks a worker.
+USER_MESSAGES_PUSH = env.bool('DJANGO_USER_MESSAGES_PUSH', default=False)
+
 ENABLE_USER_MESSAGES_RANDOM_DEBUG = env.bool(
     'DJANGO_ENABLE_USER_MESSAGES_RANDOM_DEBUG',
     default=False,
@@ -0,0 +1,5 @@
+from django.conf import settings
+
+
+def user_messages_push(request):
+    return {'user_messages_push': settings.USER_MESSAGES_PUSH}
@@ -0,0 +1,46 @@
+from time import time_ns
+
+from django.core.cache import cache
+
+
+def message_version_key(user_id: int) -> str:
+    return f'user-messages:version:{user_id}'
+
+
+def _initial_version() -> int:
+    # milliseconds, so a version evicted from the cache is never handed
+    # out again after the counter has been started anew
+    return time_ns() // 1_000_000
+
+
+def get_message_version(user_id: int) -> int | None:
+    """None if the version is unknown, ie. evicted from the cache"""
+    return cache.get(message_version_key(user_id))
+
+
+def get_or_start_message_version(user_id: int) -> int:
+    key = message_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_or_start_message_version(user_id: int) -> int:
+    key = message_version_key(user_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, _initial_version(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_message_version(user_id: int) -> None:
+    key = message_version_key(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # not in the cache yet, if a concurrent call was faster incr again
+        if not cache.add(key, _initial_version(), timeout=None):
+            cache.incr(key)
@@ -0,0 +1,14 @@
+# mypy: disable-error-code=import
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from user_messages.models import Message
+
+from core.message_versions import bump_message_version
+
+
+@receiver(post_save, sender=Message)
+def announce_new_user_message(sender, instance, created, **kwargs):
+    # api.add_message creates the messages, workers included
+    if created:
+        bump_message_version(instance.user_id)
@@ -4,6 +4,7 @@ from .views import (
     HomePageView,
     MessagesView,
     user_messages,
+    user_messages_stream,
 )
 
 # this is for reversing the urls (ie. "server:server-list")
@@ -12,6 +13,11 @@ app_name = 'core'
 urlpatterns = [
     path('', HomePageView.as_view(), name='home'),
     path('msgs/', MessagesView.as_view(), name='user-messages-snippet'),
+    path(
+        'msgs/stream/',
+        user_messages_stream,
+        name='user-messages-stream',
+    ),
     #  if json variant shoiuld be neded:
     # path('usermessages/', user_messages, name='get-user-messages'),
 ]
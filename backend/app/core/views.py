@@ -1,17 +1,37 @@
 # mypy: disable-error-code=import
+import asyncio
 import random
 
 from dataclasses import asdict
+from time import monotonic
 
+from asgiref.sync import sync_to_async
 from user_messages import api
 
-from django.http import HttpResponseRedirect, JsonResponse
+from django.http import (
+    Http404,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.template.loader import render_to_string
 from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.views.generic.base import TemplateView, RedirectView
 from django.conf import settings
 
+from core.message_versions import (
+    aget_or_start_message_version,
+    get_or_start_message_version,
+)
 from core.serializers import MessageSerializer
 
+# seconds between two looks at the (cached) message version of a stream
+STREAM_CHECK_INTERVAL = 1
+# streams are closed after this many seconds, the browser reconnects
+STREAM_DURATION = 5 * 60
+
 
 class HomePageView(TemplateView, RedirectView):
     template_name = 'core/home.html'
@@ -51,6 +71,17 @@ def user_messages(request, *args, **kwargs):
     return JsonResponse(msgs, safe=False)
 
 
+def _user_messages_etag(request, *args, **kwargs):
+    if not request.user.is_authenticated:
+        return None
+    if settings.DEBUG and settings.ENABLE_USER_MESSAGES_RANDOM_DEBUG:
+        return None
+    version = get_or_start_message_version(request.user.id)
+    return f'"{request.user.id}-{version}"'
+
+
+# answers with 304 (without loading any message) if nothing has been added
+@method_decorator(condition(etag_func=_user_messages_etag), name='get')
 class MessagesView(TemplateView):
     template_name = 'core/display_messages_snippet.html'
 
@@ -68,3 +99,52 @@ class MessagesView(TemplateView):
         context = super().get_context_data(**kwargs)
         context['messages'] = api.get_messages(request=self.request)
         return context
+
+
+def _render_user_messages(user):
+    messages = list(api.get_messages(user=user))
+    if not messages:
+        return ''
+    return render_to_string(
+        'core/display_messages_snippet.html', {'messages': messages}
+    )
+
+
+async def _user_message_events(user):
+    # reconnect after 2s if the stream breaks
+    yield 'retry: 2000\n\n'
+    last_version = -1
+    closes_at = monotonic() + STREAM_DURATION
+    while monotonic() < closes_at:
+        # only the cache is asked until a new message has been added, an
+        # evicted version is started anew and rendered once
+        version = await aget_or_start_message_version(user.id)
+        if version != last_version:
+            last_version = version
+            html = await sync_to_async(_render_user_messages)(user)
+            if html.strip():
+                data = ''.join(f'data: {line}\n' for line in html.splitlines())
+                yield f'event: user-messages\n{data}\n'
+        await asyncio.sleep(STREAM_CHECK_INTERVAL)
+
+
+async def user_messages_stream(request, *args, **kwargs):
+    """Server-sent events with the rendered user messages"""
+    if not settings.USER_MESSAGES_PUSH:
+        raise Http404('Pushing user messages is disabled.')
+    # loads the (lazy) user outside of the event loop
+    is_authenticated = await sync_to_async(
+        lambda: request.user.is_authenticated
+    )()
+    if not is_authenticated:
+        raise Http404('Pushing user messages needs a logged in user.')
+    user = request.user
+
+    response = StreamingHttpResponse(
+        _user_message_events(user),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # disable buffering in nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,12 +1,19 @@
 from django.contrib import admin
 
 from django import forms
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.urls import reverse
 from server.server_registration import ServerTypeFactory
+from server.tasks import enqueue_bulk_action
 from server.models import (
+    BulkActionJob,
+    ExecutionLease,
     ExecutionMessages,
+    ExecutionTrace,
+    InstanceActionLease,
     ServerType,
     ProvisionedServerInstance,
+    WarmServer,
 )
 
 
@@ -30,9 +37,41 @@ class ServerTypeAdmin(admin.ModelAdmin):
     form = ServerTypeForm
 
 
+def _bulk_action(action: str, description: str):
+    @admin.action(description=description)
+    def run(modeladmin, request, queryset):
+        instance_ids = list(
+            queryset.filter(server_bears_mark_of_deletion=False).values_list(
+                'id', flat=True
+            )
+        )
+        if not instance_ids:
+            modeladmin.message_user(
+                request, 'No server to act on.', messages.WARNING
+            )
+            return
+        result = enqueue_bulk_action(action, instance_ids)
+        progress_url = reverse(
+            'server:server-bulk-progress', kwargs=dict(group_id=result.id)
+        )
+        modeladmin.message_user(
+            request,
+            f'{action} of {len(instance_ids)} servers enqueued, progress: {progress_url}',
+        )
+
+    run.__name__ = f'bulk_{action}'
+    return run
+
+
 @admin.register(ProvisionedServerInstance)
 class ServerAdmin(admin.ModelAdmin):
-    actions = None
+    actions = [
+        _bulk_action('start', 'Start selected servers'),
+        _bulk_action('stop', 'Stop selected servers'),
+        _bulk_action('reboot', 'Reboot selected servers'),
+        _bulk_action('prolong', 'Prolong selected servers'),
+        _bulk_action('delete', 'Delete selected servers'),
+    ]
     readonly_fields = [
         'server_id',
         'server_address',
@@ -64,6 +103,12 @@ class ServerAdmin(admin.ModelAdmin):
         'server_address',
     ]
 
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # removes the rows without deleting the servers at the provider
+        actions.pop('delete_selected', None)
+        return actions
+
 
 @admin.register(ExecutionMessages)
 class ExecutionMessagesAdmin(admin.ModelAdmin):
@@ -80,4 +125,85 @@ class ExecutionMessagesAdmin(admin.ModelAdmin):
         'server_type',
         'admin_message',
         'admin_trace',
+        'shared_admin_trace__trace',
+    ]
+    raw_id_fields = ['shared_admin_trace']
+
+
+@admin.register(ExecutionTrace)
+class ExecutionTraceAdmin(admin.ModelAdmin):
+    list_display = [
+        '__str__',
+        'occurrences',
+        'first_seen',
+        'last_seen',
+    ]
+    search_fields = [
+        'digest',
+        'trace',
+    ]
+
+
+@admin.register(ExecutionLease)
+class ExecutionLeaseAdmin(admin.ModelAdmin):
+    list_display = [
+        '__str__',
+        'server_type',
+        'state',
+        'created',
+        'expires_at',
+    ]
+    list_filter = [
+        'server_type',
+        'state',
+    ]
+
+
+@admin.register(InstanceActionLease)
+class InstanceActionLeaseAdmin(admin.ModelAdmin):
+    list_display = [
+        '__str__',
+        'instance',
+        'state',
+        'created',
+        'expires_at',
+    ]
+    list_filter = [
+        'state',
+    ]
+    raw_id_fields = [
+        'instance',
+    ]
+
+
+@admin.register(BulkActionJob)
+class BulkActionJobAdmin(admin.ModelAdmin):
+    list_display = [
+        '__str__',
+        'instance_id',
+        'sent_at',
+    ]
+    search_fields = [
+        'group_id',
+    ]
+
+
+@admin.register(WarmServer)
+class WarmServerAdmin(admin.ModelAdmin):
+    readonly_fields = [
+        'server_id',
+        'server_address',
+        'server_password',
+        'server_name',
+    ]
+    list_display = [
+        '__str__',
+        'server_type',
+        'created',
+        'server_state',
+        'server_id',
+    ]
+    list_filter = [
+        'server_type',
+        'server_state',
     ]
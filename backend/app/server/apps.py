@@ -21,6 +21,9 @@ class ServerConfig(AppConfig):
     name = 'server'
 
     def ready(self) -> None:
+        # connects the signal receivers
+        import server.signals
+
         # this ensures all the providers are being registered
         import server.providers
 
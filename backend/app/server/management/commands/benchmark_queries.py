@@ -0,0 +1,156 @@
+from datetime import timedelta
+from time import perf_counter
+from uuid import uuid4
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from server.models import (
+    ExecutionMessages,
+    ProvisionedServerInstance,
+    ServerType,
+)
+
+BATCH_SIZE = 10_000
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = """
+    Fills the database with generated instances and execution messages and
+    shows the query plan and timing of the hot queries, with and without the
+    indexes of the server app. Everything is rolled back at the end.
+    Do not run it against a production database, the tables are locked
+    while it runs.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--instances', type=int, default=100_000)
+        parser.add_argument('--messages', type=int, default=10_000_000)
+        parser.add_argument('--users', type=int, default=1_000)
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='how often every query runs, the best time is shown',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._fill(options)
+                self._analyze()
+                self._run_queries('with indexes', options['repeat'])
+                self._drop_indexes()
+                self._analyze()
+                self._run_queries('without indexes', options['repeat'])
+                raise Rollback()
+        except Rollback:
+            self.stdout.write('generated data and dropped indexes rolled back.')
+
+    def _fill(self, options):
+        now = timezone.now()
+        server_type = ServerType.objects.create(
+            name='benchmark',
+            description='benchmark',
+            server_type_reference=f'benchmark-{uuid4()}',
+        )
+        users = get_user_model().objects.bulk_create(
+            get_user_model()(username=f'benchmark-{uuid4()}')
+            for _ in range(options['users'])
+        )
+        self.stdout.write(f'creating {options["instances"]} instances.')
+        instances = []
+        for i in range(options['instances']):
+            instances.append(
+                ProvisionedServerInstance(
+                    user=users[i % len(users)],
+                    server_type=server_type,
+                    server_id=f'benchmark-{i}',
+                    # most instances are gone, some are due soon
+                    removal_at=now + timedelta(hours=i % 1000 - 900),
+                    # one_active_server_per_type allows one per user
+                    server_bears_mark_of_deletion=i >= len(users),
+                    notify_before_destroy=i % 2 == 0,
+                    info_mail_sent=i % 4 == 0,
+                )
+            )
+            if len(instances) == BATCH_SIZE:
+                ProvisionedServerInstance.objects.bulk_create(instances)
+                instances = []
+        ProvisionedServerInstance.objects.bulk_create(instances)
+
+        self.stdout.write(f'creating {options["messages"]} messages.')
+        instance_ids = list(
+            ProvisionedServerInstance.objects.filter(
+                server_type=server_type
+            ).values_list('id', flat=True)
+        )
+        self.instance_id = instance_ids[0]
+        self.server_type = server_type
+        self.user = users[0]
+        messages = []
+        for i in range(options['messages']):
+            messages.append(
+                ExecutionMessages(
+                    instance_id=instance_ids[i % len(instance_ids)],
+                    job_id=f'benchmark-{i}',
+                    task_name='benchmark',
+                    user_message='benchmark',
+                )
+            )
+            if len(messages) == BATCH_SIZE:
+                ExecutionMessages.objects.bulk_create(messages)
+                messages = []
+        ExecutionMessages.objects.bulk_create(messages)
+
+    def _analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def _drop_indexes(self):
+        # plain sql, the sqlite schema editor refuses to run in a transaction
+        with connection.cursor() as cursor:
+            for model in [ProvisionedServerInstance, ExecutionMessages]:
+                # conditional unique constraints are unique indexes
+                for index in model._meta.indexes + model._meta.constraints:
+                    name = connection.ops.quote_name(index.name)
+                    cursor.execute(f'DROP INDEX {name}')
+
+    def _hot_queries(self):
+        now = timezone.now()
+        instance = ProvisionedServerInstance.objects.get(id=self.instance_id)
+        return {
+            'cleanup': ProvisionedServerInstance.objects.filter(
+                removal_at__lte=now, server_bears_mark_of_deletion=False
+            ),
+            'info mails': ProvisionedServerInstance.objects.filter(
+                notify_before_destroy=True,
+                info_mail_sent=False,
+                removal_at__lte=now + timedelta(weeks=12),
+            ),
+            'instance per user': ProvisionedServerInstance.objects.filter(
+                server_bears_mark_of_deletion=False,
+                server_type=self.server_type,
+                user=self.user,
+            ),
+            'log page': instance._execution_log_entries()[:26],
+        }
+
+    def _run_queries(self, title: str, repeat: int):
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        for name, queryset in self._hot_queries().items():
+            timings = []
+            for _ in range(repeat):
+                start = perf_counter()
+                list(queryset.all())
+                timings.append(perf_counter() - start)
+            self.stdout.write(
+                self.style.SUCCESS(f'{name}: {min(timings) * 1000:.2f}ms')
+            )
+            self.stdout.write(queryset.explain())
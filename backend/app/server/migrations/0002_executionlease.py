@@ -0,0 +1,36 @@
+# Generated by Django 4.2.10 on 2026-10-17 18:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='servertype',
+            name='max_paralell_executions',
+            field=models.IntegerField(blank=True, default=0, help_text='If set, only as many jobs (creation, deletion etc) of this type run at the same time. Further jobs wait for a free slot. 0 for unlimited.'),
+        ),
+        migrations.CreateModel(
+            name='ExecutionLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_id', models.CharField(max_length=255, unique=True)),
+                ('task_name', models.CharField(max_length=255)),
+                ('task_kwargs', models.JSONField(blank=True, default=dict)),
+                ('state', models.CharField(choices=[('RUNNING', 'RUNNING'), ('WAITING', 'WAITING')], max_length=20)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('server_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='server.servertype')),
+            ],
+            options={
+                'ordering': ['created', 'id'],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.10 on 2026-10-17 18:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0002_executionlease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servertype',
+            name='warm_pool_size',
+            field=models.IntegerField(blank=True, default=0, help_text='If set and supported by the template, this many servers are created ahead of time and handed out on creation. 0 to disable.'),
+        ),
+        migrations.CreateModel(
+            name='WarmServer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('server_id', models.CharField(blank=True, default='', max_length=255)),
+                ('server_name', models.CharField(blank=True, default='', max_length=255)),
+                ('server_address', models.URLField(blank=True, null=True)),
+                ('server_user', models.TextField(blank=True, null=True)),
+                ('server_password', models.TextField(blank=True, null=True)),
+                ('server_state', models.IntegerField(choices=[(-1, 'ERROR'), (10, 'CREATING'), (20, 'RUNNING'), (30, 'STOPPED'), (1000, 'UNKNOWN')], default=10)),
+                ('server_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='server.servertype')),
+            ],
+            options={
+                'get_latest_by': 'modified',
+                'abstract': False,
+            },
+        ),
+    ]
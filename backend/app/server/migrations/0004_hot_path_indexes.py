@@ -0,0 +1,33 @@
+# Generated by Django 4.2.10 on 2026-10-17 19:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0003_warm_pool'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='executionmessages',
+            index=models.Index(fields=['instance', '-created', '-id'], name='execution_log_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='provisionedserverinstance',
+            index=models.Index(condition=models.Q(('server_bears_mark_of_deletion', False)), fields=['removal_at'], name='server_due_removal_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='provisionedserverinstance',
+            index=models.Index(condition=models.Q(('server_bears_mark_of_deletion', True)), fields=['modified'], name='server_deletion_retry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='provisionedserverinstance',
+            index=models.Index(condition=models.Q(('info_mail_sent', False), ('notify_before_destroy', True)), fields=['removal_at'], name='server_info_mail_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='provisionedserverinstance',
+            index=models.Index(condition=models.Q(('server_bears_mark_of_deletion', False)), fields=['server_type', 'user'], name='server_active_per_user_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.10 on 2026-10-17 19:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0004_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='executionmessages',
+            index=models.Index(fields=['created', 'id'], name='execution_retention_idx'),
+        ),
+    ]
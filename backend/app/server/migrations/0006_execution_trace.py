@@ -0,0 +1,31 @@
+# Generated by Django 4.2.10 on 2026-10-17 19:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0005_execution_retention_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExecutionTrace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('trace', models.TextField()),
+                ('occurrences', models.PositiveIntegerField(default=1)),
+                ('first_seen', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_seen', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='executionmessages',
+            name='shared_admin_trace',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='server.executiontrace'),
+        ),
+    ]
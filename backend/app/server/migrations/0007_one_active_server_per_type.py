@@ -0,0 +1,58 @@
+# Generated by Django 4.2.10 on 2026-10-17 19:06
+
+from django.db import migrations, models
+
+
+def exempt_existing_duplicates(apps, schema_editor):
+    """
+    Servers of superusers are exempt from the limit. Of the duplicates the
+    others have already (e.g. from concurrent requests), the oldest one
+    counts and the rest is kept as exempt instead of being deleted.
+    """
+    ProvisionedServerInstance = apps.get_model(
+        'server', 'ProvisionedServerInstance'
+    )
+    active = ProvisionedServerInstance.objects.filter(
+        server_bears_mark_of_deletion=False
+    )
+    active.filter(user__is_superuser=True).update(exempt_from_type_limit=True)
+
+    seen = set()
+    exempt_ids = []
+    for instance_id, server_type_id, user_id in (
+        active.filter(exempt_from_type_limit=False)
+        .order_by('created', 'id')
+        .values_list('id', 'server_type_id', 'user_id')
+    ):
+        if (server_type_id, user_id) in seen:
+            exempt_ids.append(instance_id)
+        seen.add((server_type_id, user_id))
+    ProvisionedServerInstance.objects.filter(id__in=exempt_ids).update(
+        exempt_from_type_limit=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0006_execution_trace'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='provisionedserverinstance',
+            name='exempt_from_type_limit',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(
+            exempt_existing_duplicates, migrations.RunPython.noop
+        ),
+        migrations.RemoveIndex(
+            model_name='provisionedserverinstance',
+            name='server_active_per_user_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='provisionedserverinstance',
+            constraint=models.UniqueConstraint(condition=models.Q(('exempt_from_type_limit', False), ('server_bears_mark_of_deletion', False)), fields=('server_type', 'user'), name='one_active_server_per_type'),
+        ),
+    ]
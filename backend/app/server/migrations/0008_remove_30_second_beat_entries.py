@@ -0,0 +1,25 @@
+from django.db import migrations
+
+# replaced by hourly safety nets, see config/celery.py. The database
+# scheduler adds the entries of beat_schedule but never removes old ones.
+REMOVED_ENTRIES = [
+    'run-cleanup-every-30-seconds',
+    'send-emails-every-30-seconds',
+]
+
+
+def remove_entries(apps, schema_editor):
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    PeriodicTask.objects.filter(name__in=REMOVED_ENTRIES).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0007_one_active_server_per_type'),
+        ('django_celery_beat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_entries, migrations.RunPython.noop),
+    ]
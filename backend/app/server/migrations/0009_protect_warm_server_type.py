@@ -0,0 +1,19 @@
+# Generated by Django 4.2.10 on 2026-10-17 19:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0008_remove_30_second_beat_entries'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='warmserver',
+            name='server_type',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='server.servertype'),
+        ),
+    ]
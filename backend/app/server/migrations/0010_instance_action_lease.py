@@ -0,0 +1,31 @@
+# Generated by Django 4.2.10 on 2026-10-17 19:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0009_protect_warm_server_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstanceActionLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_id', models.CharField(max_length=255, unique=True)),
+                ('task_name', models.CharField(max_length=255)),
+                ('task_kwargs', models.JSONField(blank=True, default=dict)),
+                ('state', models.CharField(choices=[('RUNNING', 'RUNNING'), ('WAITING', 'WAITING')], max_length=20)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='server.provisionedserverinstance')),
+            ],
+            options={
+                'ordering': ['created', 'id'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.10 on 2026-10-17 19:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0010_instance_action_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='provisionedserverinstance',
+            name='info_mail_claimed_until',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
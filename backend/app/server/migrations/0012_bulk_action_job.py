@@ -0,0 +1,27 @@
+# Generated by Django 4.2.10 on 2026-10-17 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0011_info_mail_claim'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkActionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('group_id', models.CharField(db_index=True, max_length=255)),
+                ('job_id', models.CharField(max_length=255, unique=True)),
+                ('task_name', models.CharField(max_length=255)),
+                ('instance_id', models.BigIntegerField()),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
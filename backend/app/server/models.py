@@ -1,16 +1,20 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING, Type, TypeAlias
+from dataclasses import dataclass, field
 from datetime import timedelta
+from hashlib import sha256
 from uuid import uuid4
 import logging
+import re
 
 from django.contrib.auth.models import Group
 from django.contrib.auth import get_user_model
-from django.core.mail import send_mail, mail_admins
+from django.core.mail import EmailMessage
 from django.conf import settings
-from django.db import models
-from django.urls import reverse_lazy
+from django.db import IntegrityError, models, transaction
+from django.urls import reverse, reverse_lazy
 from django.utils import timezone
+from django.utils.functional import cached_property
 
 from celery.states import ALL_STATES  # type: ignore[import]
 
@@ -27,6 +31,7 @@ from server.server_registration import (
 )
 
 from server import tasks
+from server.server_type_choices import allowed_server_type_ids
 
 
 User = get_user_model()
@@ -46,6 +51,29 @@ CELERY_STATES = frozenset(
 # TODO: set celery job state when job is done, ie. using a callback
 CELERY_STATE_CHOICES = [(state, state) for state in CELERY_STATES]
 
+# the log streams shown on the detail page and the field holding their content
+EXECUTION_LOG_STREAMS = {
+    'user_messages': 'user_message',
+    'user_traces': 'user_trace',
+    'admin_messages': 'admin_message',
+    'admin_traces': 'admin_trace',
+}
+EXECUTION_LOG_PAGE_SIZE = 25
+
+
+def _has_log_content(field_name: str) -> models.Q:
+    has_content = models.Q(**{f'{field_name}__isnull': False})
+    if field_name == 'admin_trace':
+        has_content |= models.Q(shared_admin_trace__isnull=False)
+    return has_content
+
+
+def _older_than(entry) -> models.Q:
+    """The execution messages listed after entry in a log"""
+    return models.Q(created__lt=entry.created) | models.Q(
+        created=entry.created, id__lt=entry.id
+    )
+
 
 class ServerType(models.Model):
     name = models.CharField(max_length=200, null=False)
@@ -55,7 +83,7 @@ class ServerType(models.Model):
     max_paralell_executions = models.IntegerField(
         blank=True,
         default=0,
-        help_text='If set, only as many jobs for one action (creation, deletionetc) are allowed. They are retried until the limit is OK again. 0 for unlimited.',
+        help_text='If set, only as many jobs (creation, deletion etc) of this type run at the same time. Further jobs wait for a free slot. 0 for unlimited.',
     )
     remove_after_minutes = models.IntegerField(
         default=4 * 60, help_text='default is 4h.'
@@ -83,6 +111,11 @@ class ServerType(models.Model):
         max_length=200,
         unique=True,
     )
+    warm_pool_size = models.IntegerField(
+        blank=True,
+        default=0,
+        help_text='If set and supported by the template, this many servers are created ahead of time and handed out on creation. 0 to disable.',
+    )
     # todo: pass these along during creation
     template_params = models.JSONField(
         null=True,
@@ -92,28 +125,13 @@ class ServerType(models.Model):
 
     @classmethod
     def get_user_choosable_option(cls, user):
-        return cls.objects.filter(
-            models.Q(allowed_groups=None)
-            | models.Q(allowed_groups__in=user.groups.all())
-        )
+        return cls.objects.filter(id__in=allowed_server_type_ids(user))
 
     def __str__(self):
         return self.name
 
     def has_group_permission(self, user):
-        server_groups = set([g.id for g in self.allowed_groups.all()])
-
-        if len(server_groups) == 0:
-            return True
-
-        user_groups = set([g.id for g in user.groups.all()])
-
-        if (
-            len(server_groups)
-            and len(server_groups.intersection(user_groups)) > 0
-        ):
-            return True
-        return False
+        return self.pk in allowed_server_type_ids(user)
 
     def get_server_type_implementation(
         self,
@@ -150,6 +168,11 @@ class ProvisionedServerInstance(TimeStampedModel, models.Model):
     info_mail_sent = models.BooleanField(
         null=False, blank=False, default=False
     )
+    # the mail is being sent by send_info_mail, until then it is not
+    # picked up by the other mail jobs
+    info_mail_claimed_until = models.DateTimeField(
+        null=True, blank=True, editable=False
+    )
     extending_lifetime_secret = models.UUIDField(
         null=True, blank=True, editable=False, default=None
     )
@@ -162,6 +185,13 @@ class ProvisionedServerInstance(TimeStampedModel, models.Model):
         blank=False,
         default=False,
     )
+    # superusers may have several servers of a type, the database only
+    # allows one of the other instances per type and user
+    exempt_from_type_limit = models.BooleanField(
+        null=False,
+        blank=False,
+        default=False,
+    )
 
     # fields that can be updated through the providers
     # all fields can be manipulated in the admin, no restrictions
@@ -187,17 +217,52 @@ class ProvisionedServerInstance(TimeStampedModel, models.Model):
                     'You lack the permissions to create a server or there is already one.'
                 )
             self.usage = self.server_type.description
+            self.exempt_from_type_limit = self.user.is_superuser
             self.notify_before_destroy = self.server_type.notify_before_destroy
             # extra stuff, like template
             remove_after_minutes = self.server_type.remove_after_minutes
             self.removal_at = timezone.now() + timedelta(
                 minutes=remove_after_minutes
             )
-            super().save(*args, **kwargs)
-            tasks.create_server.delay(instance_id=self.id)
+            warm_server = None
+            try:
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                    if self.server_type.warm_pool_size:
+                        warm_server = WarmServer.claim(self.server_type)
+                    if warm_server is not None:
+                        self._take_over_warm_server(warm_server)
+            except IntegrityError:
+                # one_active_server_per_type, checked by the database so
+                # concurrent requests can not both pass
+                if not self._has_active_instance_of_type():
+                    raise
+                raise PermissionError(
+                    'You lack the permissions to create a server or there is already one.'
+                )
+            if warm_server is not None:
+                tasks.assign_server.delay(instance_id=self.id)
+                tasks.top_up_warm_pools.delay()
+            else:
+                tasks.create_server.delay(instance_id=self.id)
+            # the ETA jobs must not run before the instance is committed
+            transaction.on_commit(lambda: tasks.schedule_due_jobs(self))
         else:
             super().save(*args, **kwargs)
 
+    def _has_active_instance_of_type(self) -> bool:
+        return ProvisionedServerInstance.objects.filter(
+            server_type=self.server_type,
+            user=self.user,
+            server_bears_mark_of_deletion=False,
+            exempt_from_type_limit=False,
+        ).exists()
+
+    def _take_over_warm_server(self, warm_server: WarmServer):
+        for attr_name in WarmServer.server_fields:
+            setattr(self, attr_name, getattr(warm_server, attr_name))
+        super().save(update_fields=WarmServer.server_fields)
+
     def delete(self, *args, **kwargs):
         if not self._has_destroy_perms(self.user):
             raise PermissionError(
@@ -210,43 +275,27 @@ class ProvisionedServerInstance(TimeStampedModel, models.Model):
         else:
             super().delete(*args, **kwargs)
 
-    def send_deletion_notification_mail(
-        self, site
-    ) -> 'ProvisionedServerInstance':
-        if not self.server_type.prolong_by_days:
-            return self
-
+    def deletion_notification_mail(
+        self, site: str, connection=None
+    ) -> EmailMessage:
+        """
+        The mail offering to prolong the server. It sets a new
+        extending_lifetime_secret, saving it is up to the caller.
+        """
         self.extending_lifetime_secret = uuid4()
         subject = f'Your server will be deleted on {self.removal_at}. Prolong it now.'
         msg = f"""
 Your server {self} is scheduled to be removed on {self.removal_at}.
 If you want to keep if, use this link to extend its lifetime by {self.server_type.prolong_by_days} days:
-{site}{reverse_lazy('server-prolong', kwargs=dict(pk=self.id, secret=self.extending_lifetime_secret))}.
+{site}{reverse('server:server-prolong', kwargs=dict(pk=self.id, secret=self.extending_lifetime_secret))}.
 """
-
-        email = self.user.email
-        try:
-            send_mail(
-                subject,
-                msg,
-                from_email=settings.EMAIL_DEFAULT_FROM,
-                recipient_list=[email],
-                fail_silently=False,
-            )
-        except:
-            logging.error(
-                f'unable to send prolonging email. Original Mail to {email}: {msg}'
-            )
-
-            mail_admins(
-                subject=f'unable to send prolonging email.',
-                message=f'{msg}',
-            )
-
-        self.info_mail_sent = True
-        self.save()
-        logger.info('mail sent')
-        return self
+        return EmailMessage(
+            subject,
+            msg,
+            from_email=settings.EMAIL_DEFAULT_FROM,
+            to=[self.user.email],
+            connection=connection,
+        )
 
     def _has_destroy_perms(self, user: TypeAlias[User]):
         if not user.is_authenticated:
@@ -258,21 +307,6 @@ If you want to keep if, use this link to extend its lifetime by {self.server_typ
     def _has_change_perms(self, user: TypeAlias[User]):
         return self._has_destroy_perms(user)
 
-    @classmethod
-    def _user_has_instance_already(
-        cls, server_type: ServerType, user: TypeAlias[User]
-    ):
-        has_already_an_instance = (
-            ProvisionedServerInstance.objects.filter(
-                server_bears_mark_of_deletion=False
-            )
-            .filter(server_type=server_type)
-            .filter(user=user)
-            .count()
-            > 0
-        )
-        return has_already_an_instance
-
     def _has_creation_perms(self, server_type: ServerType):
         if self.user.is_superuser:
             return True
@@ -280,12 +314,6 @@ If you want to keep if, use this link to extend its lifetime by {self.server_typ
         if not self.user.is_authenticated:
             return False
 
-        has_already_an_instance = self._user_has_instance_already(
-            server_type, self.user
-        )
-        if has_already_an_instance:
-            return False
-
         if not server_type.has_group_permission(self.user):
             return False
         return True
@@ -297,24 +325,10 @@ If you want to keep if, use this link to extend its lifetime by {self.server_typ
 
     @property
     def availables_actions(self):
-        server_class = self.get_server_class()
-        create_action = isinstance(server_class, ServerTypeBase)
-        server_info_action = isinstance(server_class, ServerTypeBase)
-        delete_server_action = isinstance(server_class, ServerTypeBase)
-        restart_action = isinstance(server_class, RestartServerMixin)
-        start_action = isinstance(server_class, StartServerMixin)
-        stop_action = isinstance(server_class, StopServerMixin)
-        pw_reset_action = isinstance(server_class, ResetPasswordMixin)
-
-        return {
-            'is_crateable': create_action,
-            'can_show_server_info': server_info_action,
-            'is_deletable': delete_server_action,
-            'is_restartable': restart_action,
-            'is_startable': start_action,
-            'is_stoppable': stop_action,
-            'is_pw_resetable': pw_reset_action,
-        }
+        # computed when the ServerType class was registered
+        return ServerTypeFactory.get_available_actions(
+            self.server_type.server_type_reference
+        )
 
     def get_absolute_url(self):
         return reverse_lazy('server:server-list')
@@ -324,6 +338,84 @@ If you want to keep if, use this link to extend its lifetime by {self.server_typ
             '-created'
         )
 
+    def _execution_log_entries(self):
+        # the related manager sets entry.instance, needed by __str__
+        return (
+            self.executionmessages_set.order_by('-created', '-id')
+            .defer(*EXECUTION_LOG_STREAMS.values())
+            .annotate(
+                **{
+                    f'has_{field_name}': models.ExpressionWrapper(
+                        _has_log_content(field_name),
+                        output_field=models.BooleanField(),
+                    )
+                    for field_name in EXECUTION_LOG_STREAMS.values()
+                }
+            )
+        )
+
+    @cached_property
+    def execution_log(self) -> ExecutionLog:
+        """
+        The newest messages of the instance, loaded with one query and split
+        into the four streams shown on the detail page. The content of the
+        entries is not loaded, see ServerLogEntryView.
+        """
+        log = ExecutionLog()
+        entries = list(
+            self._execution_log_entries()[: EXECUTION_LOG_PAGE_SIZE + 1]
+        )
+        if len(entries) > EXECUTION_LOG_PAGE_SIZE:
+            entries = entries[:EXECUTION_LOG_PAGE_SIZE]
+            log.next_entries = self._streams_older_than(entries[-1])
+        for entry in entries:
+            for log_id, field_name in EXECUTION_LOG_STREAMS.items():
+                if getattr(entry, f'has_{field_name}'):
+                    getattr(log, log_id).append(entry)
+        return log
+
+    def _streams_older_than(
+        self, entry: ExecutionMessages
+    ) -> dict[str, ExecutionMessages]:
+        """The entry for each stream with older entries, in one query"""
+        older = self.executionmessages_set.filter(_older_than(entry))
+        has_older = (
+            ProvisionedServerInstance.objects.filter(pk=self.pk)
+            .values(
+                **{
+                    log_id: models.Exists(
+                        older.filter(_has_log_content(field_name))
+                    )
+                    for log_id, field_name in EXECUTION_LOG_STREAMS.items()
+                }
+            )
+            .get()
+        )
+        return {log_id: entry for log_id, more in has_older.items() if more}
+
+    def execution_log_page(
+        self,
+        log_id: str,
+        before: ExecutionMessages | None = None,
+        page_size: int = EXECUTION_LOG_PAGE_SIZE,
+    ) -> tuple[list[ExecutionMessages], ExecutionMessages | None]:
+        """
+        One page of a log stream, older than the entry before. Returns the
+        entries and the entry to continue from, if there are more.
+        """
+        field_name = EXECUTION_LOG_STREAMS[log_id]
+        entries = self._execution_log_entries().filter(
+            _has_log_content(field_name)
+        )
+        if before is not None:
+            # keyset pagination, stays fast however long the log gets
+            entries = entries.filter(_older_than(before))
+        page = list(entries[: page_size + 1])
+        if len(page) > page_size:
+            page = page[:page_size]
+            return page, page[-1]
+        return page, None
+
     def user_messages(self):
         return self.execution_messages().filter(user_message__isnull=False)
 
@@ -334,7 +426,241 @@ If you want to keep if, use this link to extend its lifetime by {self.server_typ
         return self.execution_messages().filter(admin_message__isnull=False)
 
     def admin_traces(self):
-        return self.execution_messages().filter(admin_trace__isnull=False)
+        return self.execution_messages().filter(
+            _has_log_content('admin_trace')
+        )
+
+    class Meta(TimeStampedModel.Meta):
+        indexes = [
+            # run_cleanup: instances due for removal
+            models.Index(
+                fields=['removal_at'],
+                condition=models.Q(server_bears_mark_of_deletion=False),
+                name='server_due_removal_idx',
+            ),
+            # run_cleanup: retry deletions that did not finish
+            models.Index(
+                fields=['modified'],
+                condition=models.Q(server_bears_mark_of_deletion=True),
+                name='server_deletion_retry_idx',
+            ),
+            # run_info_mail_send
+            models.Index(
+                fields=['removal_at'],
+                condition=models.Q(
+                    notify_before_destroy=True, info_mail_sent=False
+                ),
+                name='server_info_mail_due_idx',
+            ),
+        ]
+        constraints = [
+            # one server per type and user, apart from the ones being removed
+            models.UniqueConstraint(
+                fields=['server_type', 'user'],
+                condition=models.Q(
+                    server_bears_mark_of_deletion=False,
+                    exempt_from_type_limit=False,
+                ),
+                name='one_active_server_per_type',
+            ),
+        ]
+
+
+@dataclass
+class ExecutionLog:
+    user_messages: list[ExecutionMessages] = field(default_factory=list)
+    user_traces: list[ExecutionMessages] = field(default_factory=list)
+    admin_messages: list[ExecutionMessages] = field(default_factory=list)
+    admin_traces: list[ExecutionMessages] = field(default_factory=list)
+    # the entry to continue from, for the streams with older entries than
+    # the ones loaded
+    next_entries: dict[str, ExecutionMessages] = field(default_factory=dict)
+
+
+class WarmServer(TimeStampedModel, models.Model):
+    """A server created ahead of time, waiting to be handed to a user"""
+
+    # the servers of the pool have to be deleted at the provider first,
+    # shrink the pool to 0 before deleting the ServerType
+    server_type = models.ForeignKey(
+        'server.ServerType',
+        on_delete=models.PROTECT,
+        null=False,
+    )
+    # empty as long as the server is being created
+    server_id = models.CharField(blank=True, max_length=255, default='')
+    server_name = models.CharField(blank=True, max_length=255, default='')
+    server_address = models.URLField(null=True, blank=True)
+    server_user = models.TextField(null=True, blank=True)
+    server_password = models.TextField(null=True, blank=True)
+    server_state = models.IntegerField(
+        choices=ServerState.as_choices(),
+        default=int(ServerState.CREATING.value),
+    )
+
+    # fields handed over to the ProvisionedServerInstance
+    server_fields = [
+        'server_id',
+        'server_name',
+        'server_address',
+        'server_user',
+        'server_password',
+        'server_state',
+    ]
+
+    def __str__(self) -> str:
+        return f'{self.server_type}: {self.server_name or "being created"}'
+
+    @classmethod
+    def claim(cls, server_type: ServerType) -> WarmServer | None:
+        """
+        Removes a ready server of `server_type` from the pool and returns it.
+        Has to be called in a transaction.
+        """
+        warm_server = (
+            cls.objects.select_for_update(skip_locked=True)
+            .filter(
+                server_type=server_type,
+                server_state=ServerState.RUNNING.value,
+            )
+            .exclude(server_id='')
+            .order_by('created')
+            .first()
+        )
+        if warm_server is not None:
+            warm_server.delete()
+        return warm_server
+
+
+class ExecutionLease(models.Model):
+    """
+    A slot of ServerType.max_paralell_executions. It is either held by a
+    running job or the job waits for it. Waiting jobs get the slots of the
+    finished ones in the order they arrived.
+    """
+
+    RUNNING = 'RUNNING'
+    WAITING = 'WAITING'
+    STATE_CHOICES = [(RUNNING, RUNNING), (WAITING, WAITING)]
+
+    server_type = models.ForeignKey(
+        'server.ServerType',
+        on_delete=models.CASCADE,
+        null=False,
+    )
+    job_id = models.CharField(max_length=255, unique=True)
+    # needed to enqueue the job again when a slot is free
+    task_name = models.CharField(max_length=255, null=False, blank=False)
+    task_kwargs = models.JSONField(default=dict, blank=True)
+    state = models.CharField(max_length=20, choices=STATE_CHOICES)
+    created = models.DateTimeField(default=timezone.now)
+    # a running lease is given up after this, ie. when the worker died
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f'{self.task_name} ({self.job_id}): {self.state}'
+
+    class Meta:
+        ordering = ['created', 'id']
+
+
+class InstanceActionLease(models.Model):
+    """
+    The turn of a job to act on a server instance. One job acts at a time,
+    the others wait and get the turn in the order they arrived.
+    """
+
+    RUNNING = ExecutionLease.RUNNING
+    WAITING = ExecutionLease.WAITING
+    STATE_CHOICES = ExecutionLease.STATE_CHOICES
+
+    instance = models.ForeignKey(
+        'server.ProvisionedServerInstance',
+        on_delete=models.CASCADE,
+        null=False,
+    )
+    job_id = models.CharField(max_length=255, unique=True)
+    # needed to enqueue the job again when it is its turn
+    task_name = models.CharField(max_length=255, null=False, blank=False)
+    task_kwargs = models.JSONField(default=dict, blank=True)
+    state = models.CharField(max_length=20, choices=STATE_CHOICES)
+    created = models.DateTimeField(default=timezone.now)
+    # the turn is given up after this, ie. when the worker died. Extended
+    # while the job waits for an execution slot.
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f'{self.task_name} ({self.job_id}): {self.state}'
+
+    class Meta:
+        ordering = ['created', 'id']
+
+
+class BulkActionJob(models.Model):
+    """
+    A job of a bulk action. At most BULK_ACTION_PARALLELISM jobs of a
+    group are sent at a time, the row is removed when the job finished.
+    """
+
+    group_id = models.CharField(max_length=255, db_index=True)
+    job_id = models.CharField(max_length=255, unique=True)
+    task_name = models.CharField(max_length=255, null=False, blank=False)
+    # not a foreign key, a deleted instance must not drop the job
+    instance_id = models.BigIntegerField()
+    # empty as long as the job waits to be sent
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f'{self.task_name} ({self.job_id}) of {self.group_id}'
+
+    class Meta:
+        ordering = ['id']
+
+
+class ExecutionTrace(models.Model):
+    """
+    A trace stored once, however often it occurs. During an outage the same
+    failure repeats for every job, the messages then all point to one row.
+    """
+
+    # parts of a trace that differ between occurrences of the same failure
+    volatile_patterns = [
+        re.compile(r'0x[0-9a-fA-F]+'),
+        re.compile(
+            r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'
+        ),
+    ]
+
+    digest = models.CharField(max_length=64, unique=True)
+    trace = models.TextField()
+    occurrences = models.PositiveIntegerField(default=1)
+    first_seen = models.DateTimeField(default=timezone.now)
+    last_seen = models.DateTimeField(default=timezone.now)
+
+    def __str__(self) -> str:
+        # the last line of a trace names the exception
+        lines = self.trace.strip().splitlines() or ['']
+        return f'{lines[-1][0:50]} ({self.occurrences}x)'
+
+    @classmethod
+    def digest_of(cls, trace: str) -> str:
+        normalized = trace.strip()
+        for pattern in cls.volatile_patterns:
+            normalized = pattern.sub('*', normalized)
+        return sha256(normalized.encode()).hexdigest()
+
+    @classmethod
+    def record(cls, trace: str) -> ExecutionTrace:
+        """Stores the trace or counts another occurrence of it."""
+        trace_obj, created = cls.objects.get_or_create(
+            digest=cls.digest_of(trace), defaults={'trace': trace}
+        )
+        if not created:
+            cls.objects.filter(pk=trace_obj.pk).update(
+                occurrences=models.F('occurrences') + 1,
+                last_seen=timezone.now(),
+            )
+        return trace_obj
 
 
 class ExecutionMessages(TimeStampedModel, models.Model):
@@ -356,6 +682,13 @@ class ExecutionMessages(TimeStampedModel, models.Model):
     user_trace = models.TextField(null=True, blank=True)
     admin_message = models.TextField(null=True, blank=True)
     admin_trace = models.TextField(null=True, blank=True)
+    # set instead of admin_trace for the traces of failed jobs
+    shared_admin_trace = models.ForeignKey(
+        'ExecutionTrace',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+    )
 
     def __str__(self) -> str:
         info = f'{self.task_name} ({self.created}) '
@@ -365,5 +698,22 @@ class ExecutionMessages(TimeStampedModel, models.Model):
             info += f'{self.admin_message[0:10]}'
         return f'{info} ({self.instance})'
 
+    def get_content(self, field_name: str) -> str | None:
+        if field_name == 'admin_trace' and self.shared_admin_trace_id:
+            return self.shared_admin_trace.trace
+        return getattr(self, field_name)
+
     class Meta:
         ordering = ['-created']
+        indexes = [
+            # the log of an instance, see execution_log_page
+            models.Index(
+                fields=['instance', '-created', '-id'],
+                name='execution_log_idx',
+            ),
+            # prune_execution_messages
+            models.Index(
+                fields=['created', 'id'],
+                name='execution_retention_idx',
+            ),
+        ]
@@ -3,8 +3,11 @@ import random
 import string
 import os
 import logging
-from time import sleep
+import threading
+from time import monotonic, sleep
+from urllib.parse import quote
 
+from django.core.cache import cache
 from django.utils import timezone
 
 HCLOUD_TOKEN = os.environ.get('HCLOUD_TOKEN')
@@ -12,14 +15,45 @@ HCLOUD_TOKEN = os.environ.get('HCLOUD_TOKEN')
 if not HCLOUD_TOKEN:
     raise ValueError('HCLOUD_TOKEN missing from environment.')
 
+# seconds to wait between two polls of a running action, doubled on every poll
+HCLOUD_ACTION_POLL_INTERVAL = float(
+    os.environ.get('HCLOUD_ACTION_POLL_INTERVAL', 1)
+)
+HCLOUD_ACTION_POLL_MAX_INTERVAL = float(
+    os.environ.get('HCLOUD_ACTION_POLL_MAX_INTERVAL', 8)
+)
+# upper bound for waiting on an action, the previous fixed wait was 30s
+HCLOUD_ACTION_TIMEOUT = float(os.environ.get('HCLOUD_ACTION_TIMEOUT', 60))
+# connections kept alive per process, only relevant for threaded workers
+HCLOUD_POOL_MAXSIZE = int(os.environ.get('HCLOUD_POOL_MAXSIZE', 10))
+# requests per hour granted by the hetzner API, adapted to the reported quota
+HCLOUD_RATE_LIMIT = int(os.environ.get('HCLOUD_RATE_LIMIT', 3600))
+# seconds a resolved snapshot/location lookup is kept in the cache
+HCLOUD_LOOKUP_CACHE_TTL = int(
+    os.environ.get('HCLOUD_LOOKUP_CACHE_TTL', 60 * 60)
+)
+
+from celery.signals import worker_ready   # type: ignore[import]
+from requests.adapters import HTTPAdapter
 from hcloud import Client, APIException   # type: ignore[import]
+from hcloud.actions.domain import (  # type: ignore[import]
+    Action as HetznerAction,
+    ActionFailedException,
+)
+from hcloud.images.domain import Image as HetznerImage  # type: ignore[import]
+from hcloud.locations.domain import (  # type: ignore[import]
+    Location as HetznerLocation,
+)
 from hcloud.servers.domain import (  # type: ignore[import]
     Server as HetznerServer,
 )
 from hcloud.server_types.domain import (  # type: ignore[import]
     ServerType as HetznerServerType,
 )
+from server.rate_limit import TokenBucket
 from server.server_registration import (
+    ListServersMixin,
+    PrewarmServerMixin,
     ResetPasswordMixin,
     RestartServerMixin,
     ServerPasswordResetInfo,
@@ -48,6 +82,97 @@ hetzner_status_to_server_state = {
 }
 
 
+# shared by all workers, hetzner counts the requests per project
+rate_limit = TokenBucket(
+    name='hetzner',
+    capacity=HCLOUD_RATE_LIMIT,
+    refill_per_second=HCLOUD_RATE_LIMIT / 3600,
+)
+
+
+def _update_rate_limit(response, *args, **kwargs):
+    def header(name):
+        value = response.headers.get(name)
+        return int(value) if value is not None and value.isdigit() else None
+
+    rate_limit.update_remaining(
+        limit=header('RateLimit-Limit'),
+        remaining=header('RateLimit-Remaining'),
+    )
+
+
+class RateLimitedClient(Client):
+    """hcloud Client taking a token of the shared rate limit per request"""
+
+    def request(self, method, url, tries=1, **kwargs):
+        rate_limit.acquire()
+        return super().request(method, url, tries, **kwargs)
+
+
+class HetznerClientRegistry:
+    """
+    Holds one hcloud Client per process. The requests session of the client
+    keeps the connections to the API alive, so tasks don't need a new TLS
+    handshake for every call.
+
+    The client is created lazily on first use and again whenever the process
+    id changed, so every forked celery worker builds its own one instead of
+    sharing the sockets of its parent.
+    """
+
+    def __init__(self, token: str):
+        self._token = token
+        self._lock = threading.Lock()
+        self._client: Client | None = None
+        self._pid: int | None = None
+        self.clients_created = 0
+        self.clients_reused = 0
+
+    def get_client(self) -> Client:
+        pid = os.getpid()
+        with self._lock:
+            if self._client is None or self._pid != pid:
+                self._client = self._create_client()
+                self._pid = pid
+                self.clients_created = 1
+                self.clients_reused = 0
+            else:
+                self.clients_reused += 1
+            return self._client
+
+    def _create_client(self) -> Client:
+        client = RateLimitedClient(token=self._token)
+        adapter = HTTPAdapter(pool_maxsize=HCLOUD_POOL_MAXSIZE)
+        client._requests_session.mount('https://', adapter)
+        client._requests_session.hooks['response'].append(_update_rate_limit)
+        return client
+
+    def stats(self) -> dict[str, int]:
+        """Counters of the current process, ie. for logging or debugging"""
+        connections_opened = 0
+        requests_sent = 0
+        if self._client is not None and self._pid == os.getpid():
+            adapter = self._client._requests_session.get_adapter('https://')
+            pools = adapter.poolmanager.pools
+            # the pool container refuses plain iteration, keys() is a copy
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                connections_opened += pool.num_connections
+                requests_sent += pool.num_requests
+        return {
+            'clients_created': self.clients_created,
+            'clients_reused': self.clients_reused,
+            'connections_opened': connections_opened,
+            'requests_sent': requests_sent,
+            'connections_reused': max(requests_sent - connections_opened, 0),
+        }
+
+
+client_registry = HetznerClientRegistry(token=f'{HCLOUD_TOKEN}')
+
+
 def _get_server_infos_from_hetzner_server(server: HetznerServer):
     address = ""
     if server.public_net and server.public_net.primary_ipv4 and server.public_net.primary_ipv4.ip:
@@ -72,6 +197,68 @@ def _create_random_name():
     return _create_random_string(choice_pool=string.ascii_letters)
 
 
+def _lookup_cache_key(image_name: str, location: str) -> str:
+    return f'hetzner:lookup:{quote(image_name)}:{quote(location)}'
+
+
+def resolve_image_and_location(
+    image_name: str, location: str
+) -> tuple[int, int | None]:
+    """
+    Returns the ids of the snapshot with the description `image_name` and
+    of the `location`. Listing all snapshots gets slower the more snapshots
+    the project has, so the result is cached for HCLOUD_LOOKUP_CACHE_TTL.
+    """
+    key = _lookup_cache_key(image_name, location)
+    ids = cache.get(key)
+    if ids is not None:
+        return ids
+
+    client = client_registry.get_client()
+    # snapshot only have descriptions and labels
+    images = [
+        i
+        for i in client.images.get_all(type=['snapshot'])
+        if i.description == image_name
+    ]
+    if not images:
+        raise ValueError(f'No snapshot with description {image_name} found.')
+    hetzner_location = client.locations.get_by_name(location)
+    location_id = hetzner_location.id if hetzner_location else None
+
+    ids = (images[0].id, location_id)
+    cache.set(key, ids, timeout=HCLOUD_LOOKUP_CACHE_TTL)
+    return ids
+
+
+def invalidate_image_and_location(image_name: str, location: str) -> None:
+    cache.delete(_lookup_cache_key(image_name, location))
+
+
+def warm_image_and_location_cache() -> None:
+    """Resolves the lookups of all registered hetzner templates"""
+    from server.server_registration import ServerTypeFactory
+
+    lookups = {
+        (server_type_class.image_name, server_type_class.location)
+        for server_type_class in ServerTypeFactory.registry.values()
+        if isinstance(server_type_class, type)
+        and issubclass(server_type_class, ServerTypeHetzner)
+    }
+    for image_name, location in lookups:
+        try:
+            resolve_image_and_location(image_name, location)
+        except Exception:
+            logger.exception(
+                f'Could not resolve snapshot {image_name} in {location}, continuing anyway.'
+            )
+
+
+@worker_ready.connect
+def _warm_image_and_location_cache_on_worker_start(**kwargs):
+    warm_image_and_location_cache()
+
+
 def create_hetzner_server(
     server_variant,
     username,
@@ -79,19 +266,12 @@ def create_hetzner_server(
     image_name,
     location,
     description: str,
+    wait_until_running: bool = False,
 ) -> ServerCreatedInfo:
-    client = Client(token=f'{HCLOUD_TOKEN}')
+    client = client_registry.get_client()
     name = f'{server_variant}-{_create_random_name()}-{_create_random_name()}'
     server_type = HetznerServerType(name=instance_type)
-    # snapshot only have descriptions and labels
-    # image = Image(name='superset', type='snapshot')
-    image = [
-        i
-        for i in client.images.get_all(type=['snapshot'])
-        if i.description == image_name
-    ][0]
-
-    location = client.locations.get_by_name(location)
+    image_id, location_id = resolve_image_and_location(image_name, location)
     created_date = (
         str(timezone.now().isoformat('-', 'minutes'))
         .replace(':', '-')
@@ -102,14 +282,25 @@ def create_hetzner_server(
         'created-on': created_date,
         'username': username,
     }
-    response = client.servers.create(
-        name=name,
-        server_type=server_type,
-        image=image,
-        location=location,
-        labels=labels,
-    )
+    try:
+        response = client.servers.create(
+            name=name,
+            server_type=server_type,
+            image=HetznerImage(id=image_id),
+            location=HetznerLocation(id=location_id) if location_id else None,
+            labels=labels,
+        )
+    except APIException:
+        # the snapshot might have been replaced, resolve it again next time
+        invalidate_image_and_location(image_name, location)
+        raise
     server = response.server
+    if wait_until_running and all(
+        _wait_for_action(action)
+        for action in [response.action, *(response.next_actions or [])]
+    ):
+        # the server of the response is still initializing
+        server = _get_server(server.id)
     info = asdict(_get_server_infos_from_hetzner_server(server))
     # remove keys that are set again in ServerCreatedInfo
     info.pop('description', None)
@@ -124,7 +315,7 @@ def create_hetzner_server(
 
 
 def _get_server(server_id):
-    client = Client(token=f'{HCLOUD_TOKEN}')
+    client = client_registry.get_client()
     server = client.servers.get_by_id(server_id)
     return server
 
@@ -134,28 +325,65 @@ def status(server_id) -> ServerInfo:
     return _get_server_infos_from_hetzner_server(server)
 
 
+def _wait_for_action(action) -> bool:
+    """
+    Polls a hcloud action with a bounded exponential backoff.
+
+    Returns True as soon as the action succeeded and False if it is still
+    running after HCLOUD_ACTION_TIMEOUT seconds. Raises ActionFailedException
+    if hetzner reports the action as failed.
+    """
+    interval = HCLOUD_ACTION_POLL_INTERVAL
+    deadline = monotonic() + HCLOUD_ACTION_TIMEOUT
+    while action.status == HetznerAction.STATUS_RUNNING:
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            logger.warning(
+                f'action {action.id} ({action.command}) still running after {HCLOUD_ACTION_TIMEOUT}s, not waiting any longer.'
+            )
+            return False
+        sleep(min(interval, remaining))
+        interval = min(interval * 2, HCLOUD_ACTION_POLL_MAX_INTERVAL)
+        action.reload()
+
+    if action.status == HetznerAction.STATUS_ERROR:
+        raise ActionFailedException(action=action)
+    return True
+
+
 def reboot(server_id) -> ServerInfo:
     server = _get_server(server_id)
-    server.reboot()
-    # wait for server to be up again
-    sleep(30)
-    return _get_server_infos_from_hetzner_server(server)
+    _wait_for_action(server.reboot())
+    # fetch again, the server object is stale after the action
+    return status(server_id)
 
 
 def stop(server_id) -> ServerInfo:
     server = _get_server(server_id)
-    server.power_off()
-    # wait for server to be done
-    sleep(30)
-    return _get_server_infos_from_hetzner_server(server)
+    _wait_for_action(server.power_off())
+    return status(server_id)
 
 
 def start(server_id) -> ServerInfo:
     server = _get_server(server_id)
-    server.power_on()
-    # wait for server to be one again
-    sleep(30)
-    return _get_server_infos_from_hetzner_server(server)
+    _wait_for_action(server.power_on())
+    return status(server_id)
+
+
+def list_servers(server_variant) -> list[ServerInfo]:
+    """All servers created for `server_variant`, fetched page by page."""
+    client = client_registry.get_client()
+    # same labels as set in create_hetzner_server
+    servers = client.servers.get_all(
+        label_selector=f'usage={server_variant},username'
+    )
+    return [_get_server_infos_from_hetzner_server(s) for s in servers]
+
+
+def assign(server_id, username) -> ServerInfo:
+    server = _get_server(server_id)
+    server.update(labels={**(server.labels or {}), 'username': username})
+    return status(server_id)
 
 
 def reset_pw(server_id) -> ServerPasswordResetInfo:
@@ -170,10 +398,8 @@ def reset_pw(server_id) -> ServerPasswordResetInfo:
 
 def destroy(server_id) -> ServerDeletedInfo:
     server = _get_server(server_id)
-    server.delete()
-    # wait for server to be done
-    sleep(30)
-    # server is deleted!
+    _wait_for_action(server.delete())
+    # server is deleted (or hetzner is still busy removing it)!
     return ServerDeletedInfo(
         deleted=True,
         server_id=server_id,
@@ -181,6 +407,8 @@ def destroy(server_id) -> ServerDeletedInfo:
 
 
 class ServerTypeHetzner(
+    ListServersMixin,
+    PrewarmServerMixin,
     RestartServerMixin,
     ResetPasswordMixin,
     StopServerMixin,
@@ -210,12 +438,44 @@ class ServerTypeHetzner(
             description=server_instance.server_type.description or '',
         )
 
+    def create_unassigned_instance(
+        self, server_type_id, *args, **kwargs
+    ) -> ServerCreatedInfo:
+        from server.models import ServerType
+
+        server_type = ServerType.objects.get(id=server_type_id)
+        return create_hetzner_server(
+            server_variant=self.server_variant,
+            instance_type=self.instance_type,
+            # set when the server is assigned
+            username='',
+            image_name=self.image_name,
+            location=self.location,
+            description=server_type.description or '',
+            # only running servers are handed out of the pool
+            wait_until_running=True,
+        )
+
+    def assign_instance(
+        self, model_instance_id, *args, **kwargs
+    ) -> ServerInfo:
+        instance = self.get_server_instance(model_instance_id)
+        return assign(instance.server_id, instance.user.username)
+
+    def delete_unassigned_instance(
+        self, server_id, *args, **kwargs
+    ) -> ServerDeletedInfo:
+        return destroy(server_id)
+
     def get_server_info(
         self, model_instance_id: str, *args, **kwargs
     ) -> ServerInfo:
         instance = self.get_server_instance(model_instance_id)
         return status(instance.server_id)
 
+    def list_servers(self, *args, **kwargs) -> list[ServerInfo]:
+        return list_servers(self.server_variant)
+
     def reset_password(
         self, model_instance_id, *args, **kwargs
     ) -> ServerPasswordResetInfo:
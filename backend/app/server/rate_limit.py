@@ -0,0 +1,115 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from time import sleep, time
+from uuid import uuid4
+import logging
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket shared by all processes through the configured django cache.
+
+    Every call to a provider API takes a token. When the bucket is empty the
+    caller sleeps until the bucket refilled enough. The provider can correct
+    the bucket with what it reports as remaining quota.
+    """
+
+    # how long one process may hold the lock on the bucket state
+    lock_timeout = 5
+    # give up waiting for the lock after this and call anyway
+    lock_wait_limit = 2.0
+
+    def __init__(self, name: str, capacity: int, refill_per_second: float):
+        self.name = name
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        # counters of the current process
+        self.calls = 0
+        self.waited_calls = 0
+        self.waited_seconds = 0.0
+
+    @property
+    def _state_key(self) -> str:
+        return f'rate-limit:{self.name}:state'
+
+    @property
+    def _lock_key(self) -> str:
+        return f'rate-limit:{self.name}:lock'
+
+    @contextmanager
+    def _locked(self):
+        # the token tells our lock apart from one another process took
+        # after ours timed out
+        token = uuid4().hex
+        give_up_at = time() + self.lock_wait_limit
+        locked = cache.add(self._lock_key, token, timeout=self.lock_timeout)
+        while not locked and time() < give_up_at:
+            sleep(0.01)
+            locked = cache.add(
+                self._lock_key, token, timeout=self.lock_timeout
+            )
+        if not locked:
+            logger.warning(f'could not lock the rate limit of {self.name}.')
+        try:
+            yield
+        finally:
+            if locked and cache.get(self._lock_key) == token:
+                cache.delete(self._lock_key)
+
+    def _load_state(self, now: float) -> dict:
+        state = cache.get(self._state_key)
+        if state is None:
+            return {'tokens': float(self.capacity), 'updated': now}
+        refilled = (now - state['updated']) * self.refill_per_second
+        state['tokens'] = min(
+            state['tokens'] + max(refilled, 0), float(self.capacity)
+        )
+        state['updated'] = now
+        return state
+
+    def _save_state(self, state: dict):
+        cache.set(self._state_key, state, timeout=None)
+
+    def acquire(self) -> float:
+        """Takes a token, returns the seconds waited for it."""
+        waited = 0.0
+        while True:
+            with self._locked():
+                state = self._load_state(time())
+                if state['tokens'] >= 1:
+                    state['tokens'] -= 1
+                    self._save_state(state)
+                    break
+                self._save_state(state)
+                wait = (1 - state['tokens']) / self.refill_per_second
+            sleep(wait)
+            waited += wait
+
+        self.calls += 1
+        if waited:
+            self.waited_calls += 1
+            self.waited_seconds += waited
+            logger.info(f'waited {waited:.2f}s for the rate limit of {self.name}.')
+        return waited
+
+    def update_remaining(self, limit: int | None, remaining: int | None):
+        """Adapts the bucket to the quota reported by the provider."""
+        if limit:
+            self.capacity = limit
+        if remaining is None:
+            return
+        with self._locked():
+            state = self._load_state(time())
+            state['tokens'] = min(state['tokens'], float(remaining))
+            self._save_state(state)
+
+    def stats(self) -> dict[str, float]:
+        return {
+            'calls': self.calls,
+            'waited_calls': self.waited_calls,
+            'waited_seconds': self.waited_seconds,
+        }
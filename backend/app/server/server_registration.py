@@ -3,7 +3,8 @@ from typing import TYPE_CHECKING, Callable
 from abc import ABCMeta, abstractmethod
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from enum import IntEnum
+from enum import IntEnum, IntFlag
+from types import MappingProxyType
 import random
 import string
 
@@ -156,10 +157,84 @@ class StopServerMixin(metaclass=ABCMeta):
         ...
 
 
+class ListServersMixin(metaclass=ABCMeta):
+    """Mixin class for listing all servers of a ServerType with one call"""
+
+    @abstractmethod
+    def list_servers(self, *args, **kwargs) -> list[ServerInfo]:
+        ...
+
+
+class PrewarmServerMixin(metaclass=ABCMeta):
+    """Mixin class for creating servers before a user asks for one"""
+
+    @abstractmethod
+    def create_unassigned_instance(
+        self, server_type_id, *args, **kwargs
+    ) -> ServerCreatedInfo:
+        ...
+
+    @abstractmethod
+    def assign_instance(self, model_instance_id, *args, **kwargs) -> ServerInfo:
+        """Called once the server has been handed to the user of the instance"""
+        ...
+
+    @abstractmethod
+    def delete_unassigned_instance(
+        self, server_id, *args, **kwargs
+    ) -> ServerDeletedInfo:
+        ...
+
+
+class Capability(IntFlag):
+    """What a ServerType class can do, computed once at registration"""
+
+    CREATE = 1
+    SERVER_INFO = 2
+    DELETE = 4
+    RESTART = 8
+    START = 16
+    STOP = 32
+    PW_RESET = 64
+
+    @classmethod
+    def of(cls, server_type_class: type) -> Capability:
+        capabilities = cls(0)
+        if issubclass(server_type_class, ServerTypeBase):
+            capabilities |= cls.CREATE | cls.SERVER_INFO | cls.DELETE
+        if issubclass(server_type_class, RestartServerMixin):
+            capabilities |= cls.RESTART
+        if issubclass(server_type_class, StartServerMixin):
+            capabilities |= cls.START
+        if issubclass(server_type_class, StopServerMixin):
+            capabilities |= cls.STOP
+        if issubclass(server_type_class, ResetPasswordMixin):
+            capabilities |= cls.PW_RESET
+        return capabilities
+
+    def as_actions(self) -> MappingProxyType[str, bool]:
+        """The flags used by the templates, read only as they are shared"""
+        return MappingProxyType(
+            {
+                'is_crateable': Capability.CREATE in self,
+                'can_show_server_info': Capability.SERVER_INFO in self,
+                'is_deletable': Capability.DELETE in self,
+                'is_restartable': Capability.RESTART in self,
+                'is_startable': Capability.START in self,
+                'is_stoppable': Capability.STOP in self,
+                'is_pw_resetable': Capability.PW_RESET in self,
+            }
+        )
+
+
 class ServerTypeFactory:
     """The factory class for creating ServerTypes"""
 
     registry: dict[str, Callable] = {}
+    # the ServerTypes hold no state of their own, one instance is shared
+    instances: dict[str, ServerTypeBase] = {}
+    capabilities: dict[str, Capability] = {}
+    actions: dict[str, MappingProxyType[str, bool]] = {}
 
     @classmethod
     def register(cls, name_id: str) -> Callable:
@@ -176,6 +251,10 @@ class ServerTypeFactory:
                     f'Server Type {name_id} already exists. It will be replaced.'
                 )
             cls.registry[name_id] = wrapped_class
+            cls.instances.pop(name_id, None)
+            capabilities = Capability.of(wrapped_class)
+            cls.capabilities[name_id] = capabilities
+            cls.actions[name_id] = capabilities.as_actions()
             return wrapped_class
 
         return inner_wrapper
@@ -188,11 +267,12 @@ class ServerTypeFactory:
         """
         if name in cls.registry:
             del cls.registry[name]
+            cls.instances.pop(name, None)
+            cls.capabilities.pop(name, None)
+            cls.actions.pop(name, None)
 
     @classmethod
-    def create_server_type(
-        cls, name: str, **kwargs
-    ) -> ServerTypeBase | StartServerMixin | ResetPasswordMixin | RestartServerMixin | StopServerMixin:
+    def _check_registered(cls, name: str) -> None:
         if name not in cls.registry:
             logger.error(
                 'ServerType {name} does not exist in the registry', name
@@ -201,6 +281,22 @@ class ServerTypeFactory:
                 f'ServerType {name} does not exist in the registry'
             )
 
+    @classmethod
+    def create_server_type(
+        cls, name: str, **kwargs
+    ) -> ServerTypeBase | StartServerMixin | ResetPasswordMixin | RestartServerMixin | StopServerMixin:
+        """Returns the shared instance, a new one when kwargs are given"""
+        if not kwargs and name in cls.instances:
+            return cls.instances[name]
+        cls._check_registered(name)
+
         server_type_class = cls.registry[name]
         server_type = server_type_class(**kwargs)
+        if not kwargs:
+            cls.instances[name] = server_type
         return server_type
+
+    @classmethod
+    def get_available_actions(cls, name: str) -> MappingProxyType[str, bool]:
+        cls._check_registered(name)
+        return cls.actions[name]
@@ -0,0 +1,71 @@
+from hashlib import sha256
+from time import time_ns
+
+from django.core.cache import cache
+from django.db.models import Q
+
+VERSION_KEY = 'server-type-choices:version'
+# entries of older versions are not read anymore, they only need to expire
+CHOICES_TIMEOUT = 24 * 60 * 60
+
+
+def _initial_version() -> int:
+    # milliseconds, so a version evicted from the cache is never handed
+    # out again after the counter has been started anew
+    return time_ns() // 1_000_000
+
+
+def get_choices_version() -> int:
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, _initial_version(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_choices_version() -> None:
+    """Invalidates all the cached choices, see server.signals"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # not in the cache yet, if a concurrent call was faster incr again
+        if not cache.add(VERSION_KEY, _initial_version(), timeout=None):
+            cache.incr(VERSION_KEY)
+
+
+def _user_group_ids(version: int, user) -> frozenset[int]:
+    if not user.is_authenticated:
+        return frozenset()
+    return cache.get_or_set(
+        f'server-type-choices:{version}:user:{user.id}',
+        lambda: frozenset(user.groups.values_list('id', flat=True)),
+        timeout=CHOICES_TIMEOUT,
+    )
+
+
+def _allowed_for_groups(group_ids: frozenset[int]) -> frozenset[int]:
+    from server.models import ServerType
+
+    return frozenset(
+        ServerType.objects.filter(
+            Q(allowed_groups=None) | Q(allowed_groups__in=group_ids)
+        )
+        .values_list('id', flat=True)
+        .distinct()
+    )
+
+
+def allowed_server_type_ids(user) -> frozenset[int]:
+    """
+    The ids of the server types the user may use. Users with the same
+    groups share the cached entry.
+    """
+    version = get_choices_version()
+    group_ids = _user_group_ids(version, user)
+    groups = ','.join(str(group_id) for group_id in sorted(group_ids))
+    groups_digest = sha256(groups.encode()).hexdigest()
+    return cache.get_or_set(
+        f'server-type-choices:{version}:groups:{groups_digest}',
+        lambda: _allowed_for_groups(group_ids),
+        timeout=CHOICES_TIMEOUT,
+    )
@@ -0,0 +1,35 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+
+from server.models import ProvisionedServerInstance, ServerType
+from server.server_type_choices import bump_choices_version
+from server.tasks import wake_jobs_of_deleted_instance
+
+
+@receiver(m2m_changed, sender=ServerType.allowed_groups.through)
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+def invalidate_choices_on_groups_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        # after the commit, or a concurrent request caches the old choices
+        # under the new version
+        transaction.on_commit(bump_choices_version)
+
+
+@receiver(post_save, sender=ServerType)
+@receiver(post_delete, sender=ServerType)
+@receiver(post_delete, sender=Group)
+def invalidate_choices(sender, **kwargs):
+    transaction.on_commit(bump_choices_version)
+
+
+@receiver(pre_delete, sender=ProvisionedServerInstance)
+def wake_waiting_jobs(sender, instance, **kwargs):
+    wake_jobs_of_deleted_instance(instance.id)
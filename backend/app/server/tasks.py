@@ -1,15 +1,23 @@
 from __future__ import annotations
 
+from collections import Counter
 from dataclasses import asdict
 from datetime import timedelta
+from pathlib import Path
 from typing import TYPE_CHECKING
+import gzip
+import json
 from django.template import Context, Template
 
-from icecream import ic   # type: ignore[import]
-
+from django.db import transaction
+from django.db.models import Count, F, Q
 from django.utils import timezone
 from django.conf import settings
 from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.mail import get_connection, mail_admins
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.messages import (
     constants as message_constants,
 )   # type: ignore[import]
@@ -17,11 +25,22 @@ from django.contrib.messages import (
 from user_messages import api   # type: ignore[import]
 
 import celery   # type: ignore[import]
+import celery.states   # type: ignore[import]
 from celery import shared_task   # type: ignore[import]
+from celery.exceptions import Ignore   # type: ignore[import]
+from celery.result import GroupResult   # type: ignore[import]
+from celery.utils import uuid   # type: ignore[import]
 from celery.utils.log import get_task_logger   # type: ignore[import]
+from celery_progress.backend import (   # type: ignore[import]
+    PROGRESS_STATE,
+    KnownResult,
+    Progress,
+)
 
 from server.server_registration import (
     ExecutionMessage,
+    ListServersMixin,
+    PrewarmServerMixin,
     ServerCreatedInfo,
     ServerDeletedInfo,
     ServerInfo,
@@ -40,19 +59,150 @@ if TYPE_CHECKING:
 logger = get_task_logger(__name__)
 
 
+# how long a job of an instance blocks the same job of the instance from
+# being enqueued again. Countdowns and ETAs are added to this.
+ENQUEUE_LEASE_DURATION = timedelta(
+    seconds=settings.CELERY_TASK_TIME_LIMIT
+) + timedelta(minutes=10)
+
+
+def _enqueue_lease_key(task_name: str, instance_id) -> str:
+    return f'task-lease:{task_name}:{instance_id}'
+
+
+def _enqueue_lease_timeout(options: dict) -> int:
+    delay = timedelta()
+    if options.get('countdown'):
+        delay = timedelta(seconds=options['countdown'])
+    elif options.get('eta'):
+        delay = max(options['eta'] - timezone.now(), timedelta())
+    return int((ENQUEUE_LEASE_DURATION + delay).total_seconds())
+
+
+def _hold_enqueue_lease(task_name: str, task_kwargs: dict, job_id: str):
+    """Keeps a waiting or woken job the enqueued one of its instance"""
+    task = celery.current_app.tasks.get(task_name)
+    if not isinstance(task, ErrorCatcher):
+        return
+    key = task._enqueue_lease_key(task_kwargs)
+    if key is not None:
+        cache.set(key, job_id, timeout=_enqueue_lease_timeout({}))
+
+
 class ErrorCatcher(celery.Task):
+    # the jobs of an instance (kwarg instance_id) are only enqueued once at
+    # a time, a second call returns the result of the first one
+    deduplicate = True
+    # only one job with lock_instance acts on an instance at a time, the
+    # others wait for their turn in the order they arrived. Jobs of other
+    # instances are not affected.
+    lock_instance = False
+
+    def _enqueue_lease_key(self, kwargs) -> str | None:
+        if not self.deduplicate or not kwargs or 'instance_id' not in kwargs:
+            return None
+        return _enqueue_lease_key(self.name, kwargs['instance_id'])
+
+    def apply_async(self, args=None, kwargs=None, task_id=None, **options):
+        key = self._enqueue_lease_key(kwargs)
+        if key is None:
+            return super().apply_async(args, kwargs, task_id, **options)
+
+        requested_id = task_id
+        task_id = task_id or uuid()
+        timeout = _enqueue_lease_timeout(options)
+        if not cache.add(key, task_id, timeout=timeout):
+            holder = cache.get(key)
+            if holder not in (None, task_id) and requested_id is None:
+                logger.info(
+                    f'{self.name} of {kwargs["instance_id"]} is enqueued already ({holder}).'
+                )
+                return self.AsyncResult(holder)
+            # retries keep their id, the lease is extended. Jobs with an id
+            # of their own (ie. in a group) are sent and skipped when they
+            # run, their id must exist.
+            if holder in (None, task_id):
+                cache.set(key, task_id, timeout=timeout)
+        return super().apply_async(args, kwargs, task_id, **options)
+
+    def _is_duplicate(self, kwargs) -> bool:
+        key = self._enqueue_lease_key(kwargs)
+        if key is None:
+            return False
+        holder = cache.get(key)
+        if holder is None:
+            timeout = _enqueue_lease_timeout({})
+            cache.add(key, self.request.id, timeout=timeout)
+            holder = cache.get(key)
+        if holder != self.request.id:
+            logger.info(
+                f'{self.name} of {kwargs["instance_id"]} runs already ({holder}), skipping {self.request.id}.'
+            )
+            return True
+        return False
+
+    def _lock_instance(self, kwargs):
+        """Stops the job until the jobs before it acted on the instance"""
+        if not self.lock_instance or 'instance_id' not in kwargs:
+            return
+        if not acquire_instance_turn(self, kwargs['instance_id']):
+            # a slot handed to the job goes to the next one in the meantime
+            release_execution_slot(self.request.id)
+            self._report_waiting('Waiting for the other actions on the server.')
+
+    def _report_waiting(self, description: str):
+        """
+        Stops a job which has to wait, it is enqueued again when it is its
+        turn. It is reported in progress, not as finished.
+        """
+        self.update_state(
+            state=PROGRESS_STATE,
+            meta={
+                'pending': True,
+                'current': 0,
+                'total': 1,
+                'percent': 0,
+                'description': description,
+            },
+        )
+        # after_return is not called, the enqueue lease is kept
+        _hold_enqueue_lease(
+            self.name, self.request.kwargs or {}, self.request.id
+        )
+        raise Ignore()
+
+    def __call__(self, *args, **kwargs):
+        if self.request.called_directly:
+            return super().__call__(*args, **kwargs)
+        if self._is_duplicate(kwargs):
+            # a copy woken from waiting gives back what it was handed
+            release_execution_slot(self.request.id)
+            release_instance_turn(self.request.id)
+            return None
+        self._lock_instance(kwargs)
+        # not super().__call__, it would push an empty request and the job
+        # would lose its id and the flags set while it runs
+        retval = self.run(*args, **kwargs)
+        if getattr(self.request, 'waits_for_execution_slot', False):
+            if getattr(self.request, 'holds_instance_turn', False):
+                # the jobs after it keep waiting, so the order stays
+                keep_instance_turn(self.request.id)
+            self._report_waiting('Waiting for a free execution slot.')
+        return retval
+
     def on_failure(self, exc, task_id, args, kwargs, einfo):
         logger.error(
             f'{exc} ({task_id}) with args: {args} and kwargs: {kwargs} failed with error: {einfo}.'
         )
 
-        from server.models import ExecutionMessages
+        from server.models import ExecutionMessages, ExecutionTrace
 
         execution = ExecutionMessages(
             job_id=task_id,
             task_name=self.name,
             admin_message=f'{exc} ({task_id}) with args: {args} and kwargs: {kwargs} failed with an error (see trace).',
-            admin_trace=str(einfo),
+            # the same failure repeats for many jobs, it is stored once
+            shared_admin_trace=ExecutionTrace.record(str(einfo)),
         )
         try:
             if 'instance_id' in kwargs:
@@ -70,6 +220,17 @@ class ErrorCatcher(celery.Task):
             logger.error(e)
         execution.save()
 
+    def after_return(self, status, retval, task_id, args, kwargs, einfo):
+        if getattr(self.request, 'holds_execution_slot', False):
+            release_execution_slot(task_id)
+        if getattr(self.request, 'holds_instance_turn', False):
+            release_instance_turn(task_id)
+        key = self._enqueue_lease_key(kwargs)
+        if key is not None and cache.get(key) == task_id:
+            cache.delete(key)
+        # failed jobs count as done as well
+        send_next_bulk_job(task_id)
+
 
 def add_message_content_to_server_instance(
     task_name: str,
@@ -82,13 +243,13 @@ def add_message_content_to_server_instance(
 ):
     from server.models import ExecutionMessages
 
+    changed_fields = []
     attrs = server_instance.updateable_server_fields
     for attr_name in attrs:
         if (
             hasattr(message, attr_name)
             and getattr(message, attr_name) is not None
         ):
-            ic(attr_name, getattr(message, attr_name))
             # FIXME: ugly: server_state is a special case. Make it less special ;-)
             if attr_name != 'server_state':
                 value = getattr(message, attr_name)
@@ -100,7 +261,9 @@ def add_message_content_to_server_instance(
                         f'{attr_name} was not as on the message {message} object as expected.'
                     )
                     value = getattr(message, attr_name)
-            setattr(server_instance, attr_name, value)
+            if getattr(server_instance, attr_name) != value:
+                setattr(server_instance, attr_name, value)
+                changed_fields.append(attr_name)
 
     execution = ExecutionMessages(
         instance=server_instance,
@@ -115,8 +278,12 @@ def add_message_content_to_server_instance(
         execution.admin_message = message.message.admin_message
         execution.admin_trace = message.message.admin_error_trace
 
-    execution.save()
-    server_instance.save()
+    # only write the fields of the result, so concurrent changes like a
+    # prolonged removal_at are not overwritten
+    with transaction.atomic():
+        execution.save()
+        if changed_fields:
+            server_instance.save(update_fields=changed_fields + ['modified'])
 
 
 def get_server_class(
@@ -126,47 +293,375 @@ def get_server_class(
     return server_class
 
 
-def reschedule_if_max_parallel_reached(celery_task, server_instance):
+# a running job keeps its execution slot at most this long
+EXECUTION_LEASE_DURATION = timedelta(seconds=settings.CELERY_TASK_TIME_LIMIT)
+
+
+def _wake_waiting_jobs(server_type, now):
+    """
+    Hands the free slots of `server_type` to the oldest waiting jobs and
+    enqueues them again. Must be called with the server type row locked.
+    """
+    from server.models import ExecutionLease
+
+    leases = ExecutionLease.objects.filter(server_type=server_type)
+    waiting = leases.filter(state=ExecutionLease.WAITING)
+    if server_type.max_paralell_executions:
+        running_count = leases.filter(state=ExecutionLease.RUNNING).count()
+        free_slots = server_type.max_paralell_executions - running_count
+        waiting = waiting[: max(free_slots, 0)]
+
+    for lease in waiting:
+        lease.state = ExecutionLease.RUNNING
+        lease.expires_at = now + EXECUTION_LEASE_DURATION
+        lease.save(update_fields=['state', 'expires_at'])
+        _hold_enqueue_lease(lease.task_name, lease.task_kwargs, lease.job_id)
+        # the job keeps its id, the lease is found again when it starts
+        transaction.on_commit(
+            lambda lease=lease: celery.current_app.send_task(
+                lease.task_name,
+                kwargs=lease.task_kwargs,
+                task_id=lease.job_id,
+            )
+        )
+
+
+def _lock_server_type(server_type_id):
+    from server.models import ServerType
+
+    # serializes all slot changes of one server type
+    return ServerType.objects.select_for_update().get(pk=server_type_id)
+
+
+def acquire_execution_slot(celery_task, server_instance) -> bool:
+    """
+    Returns True if the job may run now. Otherwise the job is queued and
+    enqueued again as soon as a slot of its server type is free, the
+    caller must stop without doing any work.
+    """
     if server_instance is None or server_instance.server_type is None:
-        return
+        return True
+
+    if not server_instance.server_type.max_paralell_executions:
+        return True
 
-    max_paralell_executions = (
-        server_instance.server_type.max_paralell_executions
+    from server.models import ExecutionLease
+
+    job_id = celery_task.request.id
+    now = timezone.now()
+    with transaction.atomic():
+        server_type = _lock_server_type(server_instance.server_type_id)
+        _expire_execution_leases(server_type, now)
+
+        leases = ExecutionLease.objects.filter(server_type=server_type)
+        lease = leases.filter(job_id=job_id).first()
+        if lease is not None and lease.state == ExecutionLease.RUNNING:
+            # a finished job handed its slot over to this one
+            celery_task.request.holds_execution_slot = True
+            return True
+
+        waiting_ahead = leases.filter(state=ExecutionLease.WAITING)
+        if lease is not None:
+            waiting_ahead = waiting_ahead.filter(
+                Q(created__lt=lease.created)
+                | Q(created=lease.created, id__lt=lease.id)
+            )
+        running_count = leases.filter(state=ExecutionLease.RUNNING).count()
+        if (
+            running_count < server_type.max_paralell_executions
+            and not waiting_ahead.exists()
+        ):
+            ExecutionLease.objects.update_or_create(
+                job_id=job_id,
+                defaults=dict(
+                    server_type=server_type,
+                    task_name=celery_task.name,
+                    task_kwargs=celery_task.request.kwargs or {},
+                    state=ExecutionLease.RUNNING,
+                    expires_at=now + EXECUTION_LEASE_DURATION,
+                ),
+            )
+            celery_task.request.holds_execution_slot = True
+            return True
+
+        if lease is None:
+            ExecutionLease.objects.create(
+                server_type=server_type,
+                job_id=job_id,
+                task_name=celery_task.name,
+                task_kwargs=celery_task.request.kwargs or {},
+                state=ExecutionLease.WAITING,
+            )
+    logger.info(
+        f'job limit of {server_type} reached ({running_count} running), {celery_task.name} ({job_id}) waits for a free slot.'
     )
+    celery_task.request.waits_for_execution_slot = True
+    return False
 
-    if max_paralell_executions is None or max_paralell_executions == 0:
+
+def release_execution_slot(job_id: str):
+    from server.models import ExecutionLease
+
+    lease = ExecutionLease.objects.filter(
+        job_id=job_id, state=ExecutionLease.RUNNING
+    ).first()
+    if lease is None:
         return
+    with transaction.atomic():
+        server_type = _lock_server_type(lease.server_type_id)
+        ExecutionLease.objects.filter(pk=lease.pk).delete()
+        _wake_waiting_jobs(server_type, timezone.now())
+
+
+def _expire_execution_leases(server_type, now):
+    from server.models import ExecutionLease
+
+    expired, _ = ExecutionLease.objects.filter(
+        server_type=server_type,
+        state=ExecutionLease.RUNNING,
+        expires_at__lt=now,
+    ).delete()
+    if expired:
+        logger.warning(
+            f'{expired} execution slots of {server_type} expired, the jobs did not finish in time.'
+        )
+    _wake_waiting_jobs(server_type, now)
+
+
+def reap_execution_leases():
+    """
+    Frees expired slots and turns, in case no job of the type or instance
+    runs anymore. Bulk actions that got stuck go on.
+    """
+    from server.models import ExecutionLease, InstanceActionLease
+
+    now = timezone.now()
+    server_type_ids = (
+        ExecutionLease.objects.filter(expires_at__lt=now)
+        .values_list('server_type_id', flat=True)
+        .distinct()
+    )
+    for server_type_id in server_type_ids:
+        with transaction.atomic():
+            server_type = _lock_server_type(server_type_id)
+            _expire_execution_leases(server_type, now)
+
+    # the turns kept by jobs waiting for a slot
+    InstanceActionLease.objects.filter(
+        state=InstanceActionLease.RUNNING,
+        job_id__in=ExecutionLease.objects.filter(
+            state=ExecutionLease.WAITING
+        ).values('job_id'),
+    ).update(expires_at=now + INSTANCE_TURN_DURATION)
+
+    instance_ids = (
+        InstanceActionLease.objects.filter(expires_at__lt=now)
+        .values_list('instance_id', flat=True)
+        .distinct()
+    )
+    for instance_id in instance_ids:
+        with transaction.atomic():
+            _lock_instance_row(instance_id)
+            _expire_instance_turns(instance_id, now)
+            _give_instance_turn(instance_id, now)
+
+    # the enqueue leases of waiting jobs would expire otherwise and a
+    # duplicate would be sent
+    for lease_model in [ExecutionLease, InstanceActionLease]:
+        for task_name, task_kwargs, job_id in lease_model.objects.filter(
+            state=lease_model.WAITING
+        ).values_list('task_name', 'task_kwargs', 'job_id'):
+            _hold_enqueue_lease(task_name, task_kwargs, job_id)
+
+    resume_bulk_actions()
+
+
+# a job acts on its instance at most this long, ie. when the worker died
+INSTANCE_TURN_DURATION = EXECUTION_LEASE_DURATION
+
+
+def _lock_instance_row(instance_id):
+    from server.models import ProvisionedServerInstance
+
+    # serializes all turn changes of one instance, None if it is deleted
+    return (
+        ProvisionedServerInstance.objects.select_for_update()
+        .filter(pk=instance_id)
+        .values_list('id', flat=True)
+        .first()
+    )
+
+
+def _expire_instance_turns(instance_id, now):
+    from server.models import InstanceActionLease
+
+    expired, _ = InstanceActionLease.objects.filter(
+        instance_id=instance_id,
+        state=InstanceActionLease.RUNNING,
+        expires_at__lt=now,
+    ).delete()
+    if expired:
+        logger.warning(
+            f'the turn on instance {instance_id} expired, the job did not finish in time.'
+        )
+
+
+def _give_instance_turn(instance_id, now, job_id=None) -> bool:
+    """
+    Hands the turn to the oldest waiting job, if no job acts on the
+    instance. Returns True if `job_id` got it, another job is enqueued
+    again. Must be called with the instance row locked.
+    """
+    from server.models import InstanceActionLease
+
+    leases = InstanceActionLease.objects.filter(instance_id=instance_id)
+    if leases.filter(state=InstanceActionLease.RUNNING).exists():
+        return False
+    lease = leases.filter(state=InstanceActionLease.WAITING).first()
+    if lease is None:
+        return False
+    lease.state = InstanceActionLease.RUNNING
+    lease.expires_at = now + INSTANCE_TURN_DURATION
+    lease.save(update_fields=['state', 'expires_at'])
+    if lease.job_id == job_id:
+        return True
+    _send_waiting_job(lease)
+    return False
+
+
+def _send_waiting_job(lease):
+    """Enqueues a job again after the commit, it keeps its id"""
+    _hold_enqueue_lease(lease.task_name, lease.task_kwargs, lease.job_id)
+    transaction.on_commit(
+        lambda: celery.current_app.send_task(
+            lease.task_name,
+            kwargs=lease.task_kwargs,
+            task_id=lease.job_id,
+        )
+    )
+
+
+def wake_jobs_of_deleted_instance(instance_id):
+    """
+    Enqueues the jobs waiting for their turn on an instance being deleted,
+    its leases are deleted with it. The jobs find the instance gone and
+    finish, instead of waiting forever.
+    """
+    from server.models import InstanceActionLease
+
+    for lease in InstanceActionLease.objects.filter(
+        instance_id=instance_id, state=InstanceActionLease.WAITING
+    ):
+        _send_waiting_job(lease)
+
+
+def acquire_instance_turn(celery_task, instance_id) -> bool:
+    """
+    Returns True if the job may act on the instance now. Otherwise it
+    waits and is enqueued again when the jobs which arrived before it are
+    done, the caller must stop without doing any work.
+    """
+    from server.models import InstanceActionLease
+
+    job_id = celery_task.request.id
+    now = timezone.now()
+    with transaction.atomic():
+        if _lock_instance_row(instance_id) is None:
+            # deleted, the job finds out itself
+            return True
+        _expire_instance_turns(instance_id, now)
+        lease, _ = InstanceActionLease.objects.get_or_create(
+            job_id=job_id,
+            defaults=dict(
+                instance_id=instance_id,
+                task_name=celery_task.name,
+                task_kwargs=celery_task.request.kwargs or {},
+                state=InstanceActionLease.WAITING,
+            ),
+        )
+        if lease.state == InstanceActionLease.RUNNING:
+            # handed over by the job before or kept while waiting for a slot
+            lease.expires_at = now + INSTANCE_TURN_DURATION
+            lease.save(update_fields=['expires_at'])
+            has_turn = True
+        else:
+            has_turn = _give_instance_turn(instance_id, now, job_id)
+    if has_turn:
+        celery_task.request.holds_instance_turn = True
     else:
-        from server.models import ProvisionedServerInstance
-
-        # TODO: This isn't very exact, so it might be plus minus an instance
-        # at the same time
-        currently_running = ProvisionedServerInstance.objects.filter(
-            server_id__isnull=True
-        ).count()
-        # to make this better, the states of celery might be needed:
-        # from celery.states import READY_STATES, UNREADY_STATES
-        try:
-            if currently_running >= max_paralell_executions:
-                raise BufferError(
-                    f'job limit exeeded: running: {currently_running}, max: {max_paralell_executions}. Retrying in 1 minute.'
-                )
-        except BufferError as exc:
-            # Retry in 1 minute.
-            # stops the execution here
-            # https://docs.celeryq.dev/en/stable/reference/celery.app.task.html#celery.app.task.Task.retry
-            celery_task.retry(countdown=60, exc=exc)
-            raise
+        logger.info(
+            f'instance {instance_id} is busy, {celery_task.name} ({job_id}) waits for its turn.'
+        )
+    return has_turn
+
+
+def keep_instance_turn(job_id: str):
+    """
+    The job waits for an execution slot and keeps its turn. The expiry is
+    extended by reap_execution_leases as long as the job waits.
+    """
+    from server.models import InstanceActionLease
+
+    InstanceActionLease.objects.filter(
+        job_id=job_id, state=InstanceActionLease.RUNNING
+    ).update(expires_at=timezone.now() + INSTANCE_TURN_DURATION)
+
+
+def release_instance_turn(job_id: str):
+    from server.models import InstanceActionLease
+
+    lease = InstanceActionLease.objects.filter(job_id=job_id).first()
+    if lease is None:
+        return
+    with transaction.atomic():
+        _lock_instance_row(lease.instance_id)
+        InstanceActionLease.objects.filter(pk=lease.pk).delete()
+        _give_instance_turn(lease.instance_id, timezone.now())
+
+
+# instances handed to one celery group by run_cleanup
+CLEANUP_CHUNK_SIZE = 50
+# instances marked for deletion but still existing after this time
+# (ie. the deletion job failed) are claimed again
+CLEANUP_RETRY_AFTER = timedelta(hours=1)
+
+
+def _enqueue_deletions(instance_ids: list[int]):
+    for start in range(0, len(instance_ids), CLEANUP_CHUNK_SIZE):
+        chunk = instance_ids[start : start + CLEANUP_CHUNK_SIZE]
+        celery.group(
+            delete_server.si(instance_id=instance_id)
+            for instance_id in chunk
+        ).apply_async()
 
 
 @shared_task(bind=True, base=ErrorCatcher, name='remove-due-servers')
 def run_cleanup(self):
     from server.models import ProvisionedServerInstance
-    from server.tasks import delete_server
+
+    reap_execution_leases()
 
     now = timezone.now()
-    for ps in ProvisionedServerInstance.objects.filter(removal_at__lte=now):
-        delete_server.delay(instance_id=ps.id)
+    with transaction.atomic():
+        # rows locked by a concurrent run are skipped, so every instance
+        # is claimed (and gets a deletion job) only once
+        due_instance_ids = list(
+            ProvisionedServerInstance.objects.select_for_update(
+                skip_locked=True
+            )
+            .filter(
+                Q(removal_at__lte=now, server_bears_mark_of_deletion=False)
+                | Q(
+                    server_bears_mark_of_deletion=True,
+                    modified__lte=now - CLEANUP_RETRY_AFTER,
+                )
+            )
+            .values_list('id', flat=True)
+        )
+        ProvisionedServerInstance.objects.filter(
+            id__in=due_instance_ids
+        ).update(server_bears_mark_of_deletion=True, modified=now)
+        transaction.on_commit(lambda: _enqueue_deletions(due_instance_ids))
 
     # TODO: Delete obsolete servers after a certain time when they do not start
     # For example: After 25 Minutes the server is being deleted.
@@ -178,38 +673,407 @@ def run_cleanup(self):
     #     if not s.server_id:
     #         s.delete()
     #         continue
-    logger.info(f'cleanup done {now}')
+    logger.info(
+        f'cleanup done {now}, claimed {len(due_instance_ids)} instances.'
+    )
+
+
+# execution messages removed per query by prune_execution_messages
+PRUNE_BATCH_SIZE = 1000
+# batches per run, so a run and its archive stay small. The rest is
+# pruned by the next run, which is enqueued right away.
+PRUNE_MAX_BATCHES = 100
+
+
+def _execution_messages_archive():
+    archive_dir = settings.EXECUTION_MESSAGES_ARCHIVE_DIR
+    if not archive_dir:
+        return None
+    path = Path(archive_dir) / (
+        f'execution-messages-{timezone.now():%Y%m%dT%H%M%S%f}.jsonl.gz'
+    )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return gzip.open(path, 'wt', encoding='utf-8')
+
+
+@shared_task(bind=True, base=ErrorCatcher, name='prune-execution-messages')
+def prune_execution_messages(self):
+    """
+    Removes the execution messages older than the retention period, in
+    batches so the table is never locked for long. The removed rows are
+    archived, if an archive directory is set.
+    """
+    from server.models import ExecutionMessages, ExecutionTrace
+
+    retention_days = settings.EXECUTION_MESSAGES_RETENTION_DAYS
+    if not retention_days:
+        return 0
+
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    pruned = 0
+    archive = _execution_messages_archive()
+    try:
+        for _ in range(PRUNE_MAX_BATCHES):
+            batch = list(
+                ExecutionMessages.objects.filter(created__lt=cutoff)
+                .order_by('created', 'id')
+                .annotate(shared_trace=F('shared_admin_trace__trace'))
+                .values()[:PRUNE_BATCH_SIZE]
+            )
+            if not batch:
+                break
+            if archive is not None:
+                for row in batch:
+                    archive.write(json.dumps(row, cls=DjangoJSONEncoder))
+                    archive.write('\n')
+                archive.flush()
+            ExecutionMessages.objects.filter(
+                id__in=[row['id'] for row in batch]
+            ).delete()
+            pruned += len(batch)
+        else:
+            logger.info(f'pruned {pruned} execution messages, continuing.')
+            prune_execution_messages.apply_async(countdown=60)
+            return pruned
+    finally:
+        if archive is not None:
+            archive.close()
+
+    # traces no message points to anymore
+    ExecutionTrace.objects.filter(
+        executionmessages__isnull=True, last_seen__lt=cutoff
+    ).delete()
+
+    logger.info(f'pruned {pruned} execution messages older than {cutoff}.')
+    return pruned
+
+
+# removals and mails due within this time are handed to celery as ETA
+# jobs. Keep it below the consumer_timeout of RabbitMQ (30 minutes by
+# default), as a worker holds the ETA jobs unacknowledged until they run.
+SCHEDULE_HORIZON = timedelta(minutes=20)
+# schedule_due_jobs runs every SCHEDULE_HORIZON, the overlap covers its jitter
+SCHEDULE_OVERLAP = timedelta(minutes=1)
+
+
+def schedule_due_jobs(server_instance: ProvisionedServerInstance):
+    """
+    Schedules the removal and the mail of the instance, if they are due
+    soon. The later ones are scheduled by run_schedule_due_jobs.
+    """
+    now = timezone.now()
+    horizon_end = now + SCHEDULE_HORIZON + SCHEDULE_OVERLAP
+    if (
+        not server_instance.server_bears_mark_of_deletion
+        and server_instance.removal_at <= horizon_end
+    ):
+        remove_due_server.apply_async(
+            kwargs=dict(instance_id=server_instance.id),
+            eta=max(server_instance.removal_at, now),
+        )
+    mail_at = server_instance.removal_at - INFO_MAIL_BEFORE
+    if (
+        server_instance.notify_before_destroy
+        and not server_instance.info_mail_sent
+        and mail_at <= horizon_end
+    ):
+        notify_due_server.apply_async(
+            kwargs=dict(instance_id=server_instance.id),
+            eta=max(mail_at, now),
+        )
+
+
+@shared_task(bind=True, base=ErrorCatcher, name='schedule-due-jobs')
+def run_schedule_due_jobs(self):
+    """Schedules the removals and mails due before the next run"""
+    from server.models import ProvisionedServerInstance
+
+    reap_execution_leases()
+
+    horizon_end = timezone.now() + SCHEDULE_HORIZON + SCHEDULE_OVERLAP
+    due_servers = ProvisionedServerInstance.objects.filter(
+        Q(removal_at__lte=horizon_end, server_bears_mark_of_deletion=False)
+        | Q(
+            notify_before_destroy=True,
+            info_mail_sent=False,
+            removal_at__lte=horizon_end + INFO_MAIL_BEFORE,
+            server_type__prolong_by_days__gt=0,
+        )
+    ).only(
+        'id',
+        'removal_at',
+        'server_bears_mark_of_deletion',
+        'notify_before_destroy',
+        'info_mail_sent',
+    )
+    scheduled = 0
+    for server_instance in due_servers:
+        schedule_due_jobs(server_instance)
+        scheduled += 1
+    return scheduled
+
+
+@shared_task(bind=True, base=ErrorCatcher, name='remove-due-server')
+def remove_due_server(self, *, instance_id: int):
+    from server.models import ProvisionedServerInstance
+
+    now = timezone.now()
+    # a prolonged instance is not due anymore, a claimed one is not due again
+    claimed = ProvisionedServerInstance.objects.filter(
+        id=instance_id,
+        removal_at__lte=now,
+        server_bears_mark_of_deletion=False,
+    ).update(server_bears_mark_of_deletion=True, modified=now)
+    if claimed:
+        delete_server.delay(instance_id=instance_id)
+    return bool(claimed)
+
+
+@shared_task(bind=True, base=ErrorCatcher, name='notify-due-server')
+def notify_due_server(self, *, instance_id: int):
+    from server.models import ProvisionedServerInstance
+
+    now = timezone.now()
+    claimed = (
+        ProvisionedServerInstance.objects.filter(
+            id=instance_id,
+            notify_before_destroy=True,
+            info_mail_sent=False,
+            removal_at__lte=now + INFO_MAIL_BEFORE,
+            server_type__prolong_by_days__gt=0,
+        )
+        .filter(_info_mail_unclaimed(now))
+        .update(info_mail_claimed_until=now + INFO_MAIL_CLAIM_DURATION)
+    )
+    if claimed:
+        send_info_mail.delay(instance_id=instance_id)
+    return bool(claimed)
+
+
+# mails sent per run of run_info_mail_send, the rest follow in the next run
+INFO_MAIL_BATCH_SIZE = 200
+INFO_MAIL_MAX_RETRIES = 5
+# the mail is sent this long before the removal
+INFO_MAIL_BEFORE = timedelta(weeks=12)
+# a mail handed to send_info_mail is picked up again after this, if it was
+# neither sent nor given to the admins. Longer than all of its retries.
+INFO_MAIL_CLAIM_DURATION = timedelta(hours=2)
+
+
+def _info_mail_unclaimed(now) -> Q:
+    return Q(info_mail_claimed_until__isnull=True) | Q(
+        info_mail_claimed_until__lt=now
+    )
+
+
+def _site_url() -> str:
+    try:
+        site = Site.objects.get(pk=settings.SITE_ID)
+    except:
+        site = Site.objects.all()[0]
+    url = site.domain
+    if not url.startswith('http'):
+        url = f'https://{url}'
+    return url
 
 
 @shared_task(bind=True, base=ErrorCatcher, name='send-soon-due-mails')
 def run_info_mail_send(self):
     """
     renewal is only available 12 weeks before the deadline.
+
+    All due mails are sent over one connection. The ones that fail are
+    retried one by one by send_info_mail, so they do not hold up the rest.
     """
     from server.models import ProvisionedServerInstance
 
-    in_12_weeks = timezone.now() + timedelta(weeks=12)
-    unsent_servers = (
+    now = timezone.now()
+    in_12_weeks = now + INFO_MAIL_BEFORE
+    unsent_servers = list(
         ProvisionedServerInstance.objects.filter(notify_before_destroy=True)
         .filter(info_mail_sent=False)
+        .filter(_info_mail_unclaimed(now))
         .filter(removal_at__lte=in_12_weeks)
+        # without prolonging there is nothing to offer
+        .filter(server_type__prolong_by_days__gt=0)
+        .select_related('user', 'server_type')
+        .order_by('removal_at')[:INFO_MAIL_BATCH_SIZE]
+    )
+    if not unsent_servers:
+        return 0
+
+    url = _site_url()
+    sent = []
+    failed_ids = []
+    try:
+        with get_connection(fail_silently=False) as connection:
+            for server_instance in unsent_servers:
+                try:
+                    server_instance.deletion_notification_mail(
+                        url, connection
+                    ).send()
+                except Exception as e:
+                    logger.error(
+                        f'sending email for {server_instance.id} failed, continuing anyway. Error: {e}'
+                    )
+                    failed_ids.append(server_instance.id)
+                else:
+                    server_instance.info_mail_sent = True
+                    sent.append(server_instance)
+    except Exception as e:
+        # the connection could not be opened, try again with the next run
+        logger.error(f'unable to connect to the mail server. Error: {e}')
+        return 0
+
+    with transaction.atomic():
+        ProvisionedServerInstance.objects.bulk_update(
+            sent, ['extending_lifetime_secret', 'info_mail_sent']
+        )
+        # the retries own these until they are sent or the claim runs out
+        ProvisionedServerInstance.objects.filter(id__in=failed_ids).update(
+            info_mail_claimed_until=now + INFO_MAIL_CLAIM_DURATION
+        )
+        for instance_id in failed_ids:
+            transaction.on_commit(
+                lambda instance_id=instance_id: send_info_mail.apply_async(
+                    kwargs=dict(instance_id=instance_id), countdown=60
+                )
+            )
+    logger.info(f'sent {len(sent)} mails, {len(failed_ids)} to retry.')
+    return len(sent)
+
+
+@shared_task(
+    bind=True,
+    base=ErrorCatcher,
+    name='send-info-mail',
+    max_retries=INFO_MAIL_MAX_RETRIES,
+)
+def send_info_mail(self, *, instance_id: int):
+    """
+    Sends the mail of one instance claimed by the caller, see
+    info_mail_claimed_until. Retries with backoff and tells the admins when
+    it keeps failing.
+    """
+    try:
+        server_instance = _get_server_obj(instance_id)
+    except ObjectDoesNotExist:
+        return False
+    mail = server_instance.deletion_notification_mail(_site_url())
+    try:
+        mail.send()
+    except Exception as e:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=60 * 2**self.request.retries)
+        logger.error(
+            f'unable to send prolonging email. Original Mail to {mail.to}: {mail.body}'
+        )
+        mail_admins(
+            subject=f'unable to send prolonging email.',
+            message=mail.body,
+        )
+        # the admins may forward the link, it has to work
+        server_instance.info_mail_sent = True
+        server_instance.save(
+            update_fields=['extending_lifetime_secret', 'info_mail_sent']
+        )
+        return False
+    server_instance.info_mail_sent = True
+    server_instance.save(
+        update_fields=['extending_lifetime_secret', 'info_mail_sent']
+    )
+    return True
+
+
+# fields kept in sync with the provider by run_server_state_sync
+SYNCED_SERVER_FIELDS = ['server_state', 'server_address', 'server_name']
+
+
+@shared_task(bind=True, base=ErrorCatcher, name='sync-server-states')
+def run_server_state_sync(self):
+    """
+    Lists the servers of every provider supporting it with one (paginated)
+    call and writes the changed states, addresses and names back with a
+    single bulk update.
+    """
+    from server.models import (
+        ProvisionedServerInstance,
+        ServerType,
+        WarmServer,
     )
 
-    if len(unsent_servers) > 0:
+    listed_server_types = []
+    server_infos: dict[str, ServerInfo] = {}
+    # server types sharing implementation and variant list the same servers
+    listed_variants = set()
+    for server_type in ServerType.objects.all():
         try:
-            site = Site.objects.get(pk=settings.SITE_ID)
-        except:
-            site = Site.objects.all()[0]
-        url = site.domain
-        if not url.startswith('http'):
-            url = f'https://{url}'
-        for s in unsent_servers:
-            try:
-                s.send_deletion_notification_mail(url)
-            except Exception as e:
-                logger.error(
-                    f'sending email failed, continuing anyway. Error: {e}'
-                )
+            server_class = server_type.get_server_type_implementation()
+        except ValueError:
+            logger.warning(
+                f'{server_type} has no registered implementation, not syncing it.'
+            )
+            continue
+        if not isinstance(server_class, ListServersMixin):
+            continue
+        listed_server_types.append(server_type)
+        variant = (
+            type(server_class),
+            getattr(server_class, 'server_variant', None),
+        )
+        if variant in listed_variants:
+            continue
+        listed_variants.add(variant)
+        for info in server_class.list_servers():
+            server_infos[info.server_id] = info
+
+    instances = (
+        ProvisionedServerInstance.objects.filter(
+            server_type__in=listed_server_types,
+            server_bears_mark_of_deletion=False,
+        )
+        .exclude(server_id='')
+        .only('id', 'server_id', *SYNCED_SERVER_FIELDS)
+    )
+    changed_instances = _apply_server_infos(instances, server_infos)
+    ProvisionedServerInstance.objects.bulk_update(
+        changed_instances, SYNCED_SERVER_FIELDS
+    )
+
+    # pooled servers whose creation was not waited for until the end
+    warm_servers = (
+        WarmServer.objects.filter(server_type__in=listed_server_types)
+        .exclude(server_id='')
+        .only('id', 'server_id', *SYNCED_SERVER_FIELDS)
+    )
+    changed_warm_servers = _apply_server_infos(warm_servers, server_infos)
+    WarmServer.objects.bulk_update(changed_warm_servers, SYNCED_SERVER_FIELDS)
+
+    changed = len(changed_instances) + len(changed_warm_servers)
+    logger.info(f'synced {changed} of {len(server_infos)} listed servers.')
+    return changed
+
+
+def _apply_server_infos(servers, server_infos: dict[str, ServerInfo]):
+    """Sets the listed values on the servers, returns the changed ones"""
+    changed_servers = []
+    for server in servers:
+        info = server_infos.get(server.server_id)
+        if info is None:
+            continue
+        synced_values = {
+            'server_state': info.server_state.value,
+            'server_address': info.server_address,
+            'server_name': info.server_name,
+        }
+        if any(
+            getattr(server, field) != value
+            for field, value in synced_values.items()
+        ):
+            for field, value in synced_values.items():
+                setattr(server, field, value)
+            changed_servers.append(server)
+    return changed_servers
 
 
 def _get_server_obj(instance_id: int):
@@ -221,10 +1085,12 @@ def _get_server_obj(instance_id: int):
 @shared_task(
     bind=True,
     base=ErrorCatcher,
+    lock_instance=True,
 )
 def create_server(self, *, instance_id: int):
     server_instance = _get_server_obj(instance_id)
-    reschedule_if_max_parallel_reached(self, server_instance)
+    if not acquire_execution_slot(self, server_instance):
+        return None
 
     api.add_message(
         user=server_instance.user,
@@ -237,9 +1103,7 @@ def create_server(self, *, instance_id: int):
             '{server_class} is not a ServerTypeBase and canot create a server'
         )
     result = server_class.create_instance(model_instance_id=server_instance.id)
-    
-    t = Template(server_instance.server_type.user_message)
-    result.message = ExecutionMessage(t.render(context=Context(dict(server=result))))
+    result.message = _render_user_message(server_instance, server=result)
 
     add_message_content_to_server_instance(
         self.name, self.request.id, result, server_instance
@@ -256,10 +1120,152 @@ def create_server(self, *, instance_id: int):
 @shared_task(
     bind=True,
     base=ErrorCatcher,
+    lock_instance=True,
+)
+def assign_server(self, *, instance_id: int):
+    """Finishes an instance which got a server from the warm pool"""
+    server_instance = _get_server_obj(instance_id)
+    if not acquire_execution_slot(self, server_instance):
+        return None
+
+    server_class = get_server_class(server_instance)
+    if not isinstance(server_class, PrewarmServerMixin):
+        raise ValueError(
+            '{server_class} has no PrewarmServerMixin and canot assign a server'
+        )
+    result = server_class.assign_instance(model_instance_id=server_instance.id)
+    # the warm server already has been copied to the instance
+    result.message = _render_user_message(
+        server_instance, server=server_instance
+    )
+
+    add_message_content_to_server_instance(
+        self.name, self.request.id, result, server_instance
+    )
+
+    api.add_message(
+        user=server_instance.user,
+        level=message_constants.SUCCESS,
+        message=f'Server {server_instance} is ready.',
+    )
+    return asdict(result)
+
+
+def _render_user_message(server_instance, server) -> ExecutionMessage:
+    t = Template(server_instance.server_type.user_message)
+    return ExecutionMessage(t.render(context=Context(dict(server=server))))
+
+
+def _get_prewarm_server_class(server_type) -> PrewarmServerMixin | None:
+    try:
+        server_class = server_type.get_server_type_implementation()
+    except ValueError:
+        return None
+    if not isinstance(server_class, PrewarmServerMixin):
+        return None
+    return server_class
+
+
+@shared_task(bind=True, base=ErrorCatcher, name='top-up-warm-pools')
+def top_up_warm_pools(self):
+    """
+    Creates the missing servers of every warm pool and removes the ready
+    servers exceeding a shrunk pool.
+    """
+    from server.models import ServerType, WarmServer
+
+    server_type_ids = (
+        ServerType.objects.annotate(pool_count=Count('warmserver'))
+        .filter(Q(warm_pool_size__gt=0) | Q(pool_count__gt=0))
+        .values_list('id', flat=True)
+    )
+    for server_type_id in server_type_ids:
+        # a top up after a claim may run alongside the periodic one
+        with transaction.atomic():
+            server_type = _lock_server_type(server_type_id)
+            if _get_prewarm_server_class(server_type) is None:
+                logger.warning(
+                    f'{server_type} does not support a warm pool, not filling it.'
+                )
+                continue
+            missing = (
+                server_type.warm_pool_size
+                - WarmServer.objects.filter(server_type=server_type).count()
+            )
+            for _ in range(missing):
+                warm_server = WarmServer.objects.create(
+                    server_type=server_type
+                )
+                transaction.on_commit(
+                    lambda warm_server=warm_server: create_warm_server.delay(
+                        warm_server_id=warm_server.id
+                    )
+                )
+            for _ in range(-missing):
+                warm_server = WarmServer.claim(server_type)
+                if warm_server is None:
+                    break
+                kwargs = dict(
+                    server_type_id=server_type_id,
+                    server_id=warm_server.server_id,
+                )
+                transaction.on_commit(
+                    lambda kwargs=kwargs: delete_warm_server.delay(**kwargs)
+                )
+
+
+@shared_task(bind=True, base=ErrorCatcher)
+def create_warm_server(self, *, warm_server_id: int):
+    from server.models import WarmServer
+
+    warm_server = WarmServer.objects.select_related('server_type').get(
+        pk=warm_server_id
+    )
+    server_class = _get_prewarm_server_class(warm_server.server_type)
+    if server_class is None:
+        warm_server.delete()
+        raise ValueError(
+            f'{warm_server.server_type} cannot create servers for a warm pool.'
+        )
+    try:
+        result = server_class.create_unassigned_instance(
+            server_type_id=warm_server.server_type_id
+        )
+    except Exception:
+        # free the place in the pool, the next top up tries again
+        warm_server.delete()
+        raise
+
+    for attr_name in WarmServer.server_fields:
+        value = getattr(result, attr_name)
+        if attr_name == 'server_state':
+            value = value.value
+        setattr(warm_server, attr_name, value)
+    warm_server.save()
+    return asdict(result)
+
+
+@shared_task(bind=True, base=ErrorCatcher)
+def delete_warm_server(self, *, server_type_id: int, server_id: str):
+    from server.models import ServerType
+
+    server_class = _get_prewarm_server_class(
+        ServerType.objects.get(pk=server_type_id)
+    )
+    if server_class is None:
+        raise ValueError(f'server {server_id} cannot be deleted.')
+    return asdict(server_class.delete_unassigned_instance(server_id=server_id))
+
+
+@shared_task(
+    bind=True,
+    base=ErrorCatcher,
+    lock_instance=True,
 )
 def start_server(self, *, instance_id: int):
     server_instance = _get_server_obj(instance_id)
-    reschedule_if_max_parallel_reached(self, server_instance)
+    if not acquire_execution_slot(self, server_instance):
+        return None
 
     server_class = get_server_class(server_instance)
     if not isinstance(server_class, StartServerMixin):
@@ -285,10 +1291,12 @@ def start_server(self, *, instance_id: int):
 @shared_task(
     bind=True,
     base=ErrorCatcher,
+    lock_instance=True,
 )
 def stop_server(self, *, instance_id: int):
     server_instance = _get_server_obj(instance_id)
-    reschedule_if_max_parallel_reached(self, server_instance)
+    if not acquire_execution_slot(self, server_instance):
+        return None
 
     server_class = get_server_class(server_instance)
 
@@ -313,10 +1321,12 @@ def stop_server(self, *, instance_id: int):
 @shared_task(
     bind=True,
     base=ErrorCatcher,
+    lock_instance=True,
 )
 def reboot_server(self, *, instance_id: int):
     server_instance = _get_server_obj(instance_id)
-    reschedule_if_max_parallel_reached(self, server_instance)
+    if not acquire_execution_slot(self, server_instance):
+        return None
 
     server_class = get_server_class(server_instance)
     if not isinstance(server_class, RestartServerMixin):
@@ -339,10 +1349,12 @@ def reboot_server(self, *, instance_id: int):
 @shared_task(
     bind=True,
     base=ErrorCatcher,
+    lock_instance=True,
 )
 def pw_reset_server(self, *, instance_id: int):
     server_instance = _get_server_obj(instance_id)
-    reschedule_if_max_parallel_reached(self, server_instance)
+    if not acquire_execution_slot(self, server_instance):
+        return None
 
     server_class = get_server_class(server_instance)
     if not isinstance(server_class, ResetPasswordMixin):
@@ -366,15 +1378,20 @@ def pw_reset_server(self, *, instance_id: int):
 @shared_task(
     bind=True,
     base=ErrorCatcher,
+    lock_instance=True,
 )
 def prolong_server(self, *, instance_id: int):
     server_instance = _get_server_obj(instance_id)
-    reschedule_if_max_parallel_reached(self, server_instance)
+    if not acquire_execution_slot(self, server_instance):
+        return None
 
     if server_instance.server_type.prolong_by_days:
         server_instance.removal_at += timedelta(
             days=server_instance.server_type.prolong_by_days
         )
+        # only removal_at, the other fields may be changed meanwhile
+        server_instance.save(update_fields=['removal_at', 'modified'])
+        schedule_due_jobs(server_instance)
 
         server_class = get_server_class(server_instance)
         if not isinstance(server_class, ServerTypeBase):
@@ -415,10 +1432,16 @@ def prolong_server(self, *, instance_id: int):
 @shared_task(
     bind=True,
     base=ErrorCatcher,
+    lock_instance=True,
 )
 def delete_server(self, *, instance_id: int):
-    server_instance = _get_server_obj(instance_id)
-    reschedule_if_max_parallel_reached(self, server_instance)
+    try:
+        server_instance = _get_server_obj(instance_id)
+    except ObjectDoesNotExist:
+        logger.info(f'instance {instance_id} is already deleted.')
+        return None
+    if not acquire_execution_slot(self, server_instance):
+        return None
     user = server_instance.user
     server_id = server_instance.server_id
     deletion_info = ServerDeletedInfo(server_id=server_id, deleted=False)
@@ -429,14 +1452,181 @@ def delete_server(self, *, instance_id: int):
                 '{server_class} is no ServerTypeBase and cannot delete a server'
             )
         deletion_info = server_class.delete_server(server_instance.id)
-    server_instance.delete(really_delete=True)
     deletion_info.deleted = True
+    # record the result before removing the row, saving the instance
+    # afterwards would insert it again
+    add_message_content_to_server_instance(
+        self.name, self.request.id, deletion_info, server_instance
+    )
+    server_instance.delete(really_delete=True)
     api.add_message(
         user=user,
         level=message_constants.INFO,
         message=f'Server {server_id} has been deleted.',
     )
-    add_message_content_to_server_instance(
-        self.name, self.request.id, deletion_info, server_instance
-    )
     return asdict(deletion_info)
+
+
+# the actions operators can run on many instances at once
+BULK_ACTIONS = {
+    'start': start_server,
+    'stop': stop_server,
+    'reboot': reboot_server,
+    'prolong': prolong_server,
+    'delete': delete_server,
+}
+# at most this many jobs of a bulk action are enqueued or running at a
+# time, every finished job enqueues the next one. The jobs of the users
+# are not stuck behind a few hundred servers in the queue.
+BULK_ACTION_PARALLELISM = 20
+# a sent job not finished after this does not hold up the group anymore,
+# ie. when the worker died
+BULK_ACTION_JOB_TIMEOUT = timedelta(hours=24)
+
+
+def _send_bulk_job(task_name: str, group_id: str, job_id: str, instance_id):
+    celery.current_app.tasks[task_name].apply_async(
+        kwargs=dict(instance_id=instance_id),
+        task_id=job_id,
+        group_id=group_id,
+    )
+
+
+def _send_bulk_jobs(group_id: str, finished_job_id: str | None = None):
+    """
+    Sends the next jobs of the group, as many as there are free places.
+    `finished_job_id` gives its place to the next one.
+    """
+    from server.models import BulkActionJob
+
+    with transaction.atomic():
+        # locked in order, so concurrent calls of the group queue up
+        jobs = list(
+            BulkActionJob.objects.select_for_update()
+            .filter(group_id=group_id)
+            .order_by('id')
+        )
+        if finished_job_id is not None:
+            BulkActionJob.objects.filter(job_id=finished_job_id).delete()
+            jobs = [job for job in jobs if job.job_id != finished_job_id]
+        sent = sum(1 for job in jobs if job.sent_at is not None)
+        next_jobs = [job for job in jobs if job.sent_at is None][
+            : max(BULK_ACTION_PARALLELISM - sent, 0)
+        ]
+        BulkActionJob.objects.filter(
+            id__in=[job.id for job in next_jobs]
+        ).update(sent_at=timezone.now())
+        for job in next_jobs:
+            transaction.on_commit(
+                lambda job=job: _send_bulk_job(
+                    job.task_name, group_id, job.job_id, job.instance_id
+                )
+            )
+
+
+def enqueue_bulk_action(action: str, instance_ids: list[int]):
+    """
+    Runs the action on all the instances as one celery group, with at most
+    BULK_ACTION_PARALLELISM jobs at a time. Returns the saved GroupResult,
+    it can be followed with get_bulk_action_progress.
+    """
+    from server.models import BulkActionJob, ProvisionedServerInstance
+
+    task = BULK_ACTIONS[action]
+    if action == 'delete':
+        # modified as well, run_cleanup retries the deletions only after
+        # CLEANUP_RETRY_AFTER
+        ProvisionedServerInstance.objects.filter(id__in=instance_ids).update(
+            server_bears_mark_of_deletion=True, modified=timezone.now()
+        )
+    group_id = uuid()
+    jobs = [
+        BulkActionJob(
+            group_id=group_id,
+            job_id=uuid(),
+            task_name=task.name,
+            instance_id=instance_id,
+        )
+        for instance_id in instance_ids
+    ]
+    result = GroupResult(
+        group_id, [task.AsyncResult(job.job_id) for job in jobs]
+    )
+    result.save()
+
+    BulkActionJob.objects.bulk_create(jobs)
+    _send_bulk_jobs(group_id)
+    return result
+
+
+def send_next_bulk_job(job_id: str):
+    """Enqueues the next job of the bulk action `job_id` belonged to"""
+    from server.models import BulkActionJob
+
+    # also the jobs woken after waiting are found again by their id
+    group_id = (
+        BulkActionJob.objects.filter(job_id=job_id)
+        .values_list('group_id', flat=True)
+        .first()
+    )
+    if group_id is not None:
+        _send_bulk_jobs(group_id, finished_job_id=job_id)
+
+
+def resume_bulk_actions():
+    """
+    Drops the sent jobs which finished without making room for the next
+    ones or did not finish in time, and sends the next jobs of the groups.
+    """
+    from django_celery_results.models import TaskResult
+    from server.models import BulkActionJob
+
+    sent_jobs = BulkActionJob.objects.filter(sent_at__isnull=False)
+    finished_job_ids = TaskResult.objects.filter(
+        task_id__in=sent_jobs.values('job_id'),
+        status__in=celery.states.READY_STATES,
+    ).values('task_id')
+    sent_jobs.filter(
+        Q(job_id__in=finished_job_ids)
+        | Q(sent_at__lt=timezone.now() - BULK_ACTION_JOB_TIMEOUT)
+    ).delete()
+
+    group_ids = (
+        BulkActionJob.objects.filter(sent_at__isnull=True)
+        .order_by('group_id')
+        .values_list('group_id', flat=True)
+        .distinct()
+    )
+    for group_id in group_ids:
+        _send_bulk_jobs(group_id)
+
+
+def get_bulk_action_progress(group_id: str) -> dict | None:
+    """The progress of a bulk action, in the format of celery_progress"""
+    from django_celery_results.models import TaskResult
+
+    result = GroupResult.restore(group_id)
+    if result is None:
+        return None
+    total = len(result.results)
+    # one query for the whole group instead of one per job
+    states = Counter(
+        TaskResult.objects.filter(
+            task_id__in=[job.id for job in result.results]
+        ).values_list('status', flat=True)
+    )
+    succeeded = states[celery.states.SUCCESS]
+    done = sum(states[state] for state in celery.states.READY_STATES)
+    if done < total:
+        state = PROGRESS_STATE
+        info = {
+            'pending': False,
+            'current': done,
+            'total': total,
+            'percent': round(100 * done / total, 2),
+            'description': f'{done} of {total} done',
+        }
+    else:
+        state = celery.states.SUCCESS
+        info = {'succeeded': succeeded, 'failed': total - succeeded}
+    return Progress(KnownResult(group_id, info, state)).get_info()
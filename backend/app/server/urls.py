@@ -3,6 +3,8 @@ from django.urls import include, path
 from .views import (
     ServerListView,
     ServerDetailView,
+    ServerLogView,
+    ServerLogEntryView,
     ServerCreateView,
     ServerDeleteView,
     ServerPWResetViewView,
@@ -10,6 +12,8 @@ from .views import (
     ServerProlongView,
     ServerStopView,
     ServerStartView,
+    ServerBulkActionView,
+    ServerBulkProgressView,
 )
 
 # this is for reversing the urls (ie. "server:server-list")
@@ -23,6 +27,16 @@ urlpatterns = [
         ServerDetailView.as_view(),
         name='server-details',
     ),
+    path(
+        '<int:pk>/logs/<str:log_id>/',
+        ServerLogView.as_view(),
+        name='server-log',
+    ),
+    path(
+        '<int:pk>/logs/<str:log_id>/<int:entry_id>/',
+        ServerLogEntryView.as_view(),
+        name='server-log-entry',
+    ),
     path(
         '<int:pk>/delete/',
         ServerDeleteView.as_view(),
@@ -53,6 +67,12 @@ urlpatterns = [
         ServerProlongView.as_view(),
         name='server-prolong',
     ),
+    path('bulk/', ServerBulkActionView.as_view(), name='server-bulk'),
+    path(
+        'bulk/<str:group_id>/',
+        ServerBulkProgressView.as_view(),
+        name='server-bulk-progress',
+    ),
     path(
         'celery-progress/',
         include('celery_progress.urls', namespace='celery-progress'),
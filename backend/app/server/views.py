@@ -1,33 +1,56 @@
 from django.contrib.messages import constants as message_constants
-from django.http import HttpResponseRedirect
+from django.http import (
+    Http404,
+    HttpResponseBadRequest,
+    HttpResponseRedirect,
+    JsonResponse,
+)
+from django.shortcuts import get_object_or_404
 from django.urls import reverse, reverse_lazy
 from django.views.generic import (
     ListView,
     CreateView,
     DeleteView,
     DetailView,
+    View,
+)
+from django.contrib.auth.mixins import (
+    LoginRequiredMixin,
+    UserPassesTestMixin,
 )
-from django.contrib.auth.mixins import LoginRequiredMixin
 
 from user_messages import api   # type: ignore[import]
 
 from server.tasks import (
+    BULK_ACTIONS,
     create_server,
     delete_server,
+    enqueue_bulk_action,
+    get_bulk_action_progress,
     prolong_server,
     pw_reset_server,
     reboot_server,
     start_server,
     stop_server,
 )
-from server.models import ServerType, ProvisionedServerInstance
+from server.models import (
+    EXECUTION_LOG_STREAMS,
+    ServerType,
+    ProvisionedServerInstance,
+)
 
 
 class ServerMixin(LoginRequiredMixin):   # type: ignore[misc]
     model = ProvisionedServerInstance
 
     def get_queryset(self):
-        qs = super().get_queryset().filter(server_bears_mark_of_deletion=False)
+        qs = (
+            super()
+            .get_queryset()
+            .filter(server_bears_mark_of_deletion=False)
+            # used by __str__ and the templates
+            .select_related('user', 'server_type')
+        )
         if self.request.user.is_superuser:
             return qs
         return qs.filter(user=self.request.user)
@@ -49,6 +72,61 @@ class ServerDetailView(ServerMixin, DetailView):   # type: ignore[misc]
     context_object_name = 'server'
 
 
+class ServerLogMixin(ServerMixin):
+    """Access to one log stream (logId in the templates) of a server"""
+
+    admin_logs = ['admin_messages', 'admin_traces']
+
+    def get_log_id(self) -> str:
+        log_id = self.kwargs['log_id']
+        if log_id not in EXECUTION_LOG_STREAMS:
+            raise Http404('Unknown log.')
+        if log_id in self.admin_logs and not self.request.user.is_superuser:
+            raise Http404('Unknown log.')
+        return log_id
+
+
+class ServerLogView(ServerLogMixin, DetailView):   # type: ignore[misc]
+    """The next page of a log stream, loaded when scrolling down"""
+
+    template_name = 'server/snippets/log_entries.html'
+    context_object_name = 'server'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        log_id = self.get_log_id()
+        before = None
+        if 'before' in self.request.GET:
+            if not self.request.GET['before'].isdigit():
+                raise Http404('Unknown log entry.')
+            before = get_object_or_404(
+                self.object.executionmessages_set.only('id', 'created'),
+                pk=self.request.GET['before'],
+            )
+        logs, next_entry = self.object.execution_log_page(log_id, before)
+        context.update(logs=logs, logId=log_id, next_entry=next_entry)
+        return context
+
+
+class ServerLogEntryView(ServerLogMixin, DetailView):   # type: ignore[misc]
+    """The content of one log entry, loaded when the entry is expanded"""
+
+    template_name = 'server/snippets/log_entry.html'
+    context_object_name = 'server'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        field_name = EXECUTION_LOG_STREAMS[self.get_log_id()]
+        entry = get_object_or_404(
+            self.object.executionmessages_set.select_related(
+                'shared_admin_trace'
+            ),
+            pk=self.kwargs['entry_id'],
+        )
+        context['content'] = entry.get_content(field_name)
+        return context
+
+
 class ServerCreateView(ServerMixin, CreateView):   # type: ignore[misc]
     template_name = 'server/server_add.html'
     fields = ['server_type']
@@ -63,7 +141,14 @@ class ServerCreateView(ServerMixin, CreateView):   # type: ignore[misc]
     def form_valid(self, form):
         """If the form is valid, save the associated model."""
         form.instance.user = self.request.user
-        self.object = form.save()
+        try:
+            self.object = form.save()
+        except PermissionError:
+            # the types the user may not use are not in the form
+            form.add_error(
+                'server_type', 'You already have a server of this type.'
+            )
+            return self.form_invalid(form)
         api.add_message(
             user=self.request.user,
             level=message_constants.INFO,
@@ -71,31 +156,6 @@ class ServerCreateView(ServerMixin, CreateView):   # type: ignore[misc]
         )
         return HttpResponseRedirect(self.get_success_url())
 
-    def post(self, request, *args, **kwargs):
-        """
-        Handle POST requests: instantiate a form instance with the passed
-        POST variables and then check if it's valid.
-        """
-        self.object = None
-        form = self.get_form()
-
-        server_type = form.data['server_type']
-        has_server_already = (
-            ProvisionedServerInstance._user_has_instance_already(
-                server_type, request.user
-            )
-        )
-
-        if has_server_already:
-            form.add_error(
-                'server_type', 'You already have a server of this type.'
-            )
-
-        if form.is_valid():
-            return self.form_valid(form)
-        else:
-            return self.form_invalid(form)
-
 
 class ServerDeleteView(ServerMixin, DeleteView):   # type: ignore[misc]
     template_name = 'server/server_confirm_delete.html'
@@ -189,3 +249,55 @@ class ServerPWResetViewView(ServerMixin, DeleteView):   # type: ignore[misc]
         )
         pw_reset_server.delay(instance_id=self.object.id)
         return HttpResponseRedirect(success_url)
+
+
+class SuperuserRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
+    def test_func(self):
+        return self.request.user.is_superuser
+
+
+class ServerBulkActionView(SuperuserRequiredMixin, View):
+    """
+    Runs an action (start, stop, reboot, prolong, delete) on many servers.
+    Expects the action and a list of instance_ids as form data.
+    """
+
+    def post(self, request, *args, **kwargs):
+        action = request.POST.get('action')
+        if action not in BULK_ACTIONS:
+            return HttpResponseBadRequest('Unknown action.')
+        selected_ids = request.POST.getlist('instance_ids')
+        if not all(instance_id.isdigit() for instance_id in selected_ids):
+            return HttpResponseBadRequest('Unknown servers.')
+        instance_ids = list(
+            ProvisionedServerInstance.objects.filter(
+                id__in=selected_ids,
+                server_bears_mark_of_deletion=False,
+            ).values_list('id', flat=True)
+        )
+        if not instance_ids:
+            return HttpResponseBadRequest('No servers selected.')
+
+        result = enqueue_bulk_action(action, instance_ids)
+        return JsonResponse(
+            {
+                'group_id': result.id,
+                'instance_ids': instance_ids,
+                'progress_url': reverse(
+                    'server:server-bulk-progress',
+                    kwargs=dict(group_id=result.id),
+                ),
+            }
+        )
+
+
+class ServerBulkProgressView(SuperuserRequiredMixin, View):
+    """The progress of a bulk action, for the celery_progress javascript"""
+
+    def get(self, request, *args, **kwargs):
+        progress = get_bulk_action_progress(self.kwargs['group_id'])
+        if progress is None:
+            raise Http404('Unknown bulk action.')
+        response = JsonResponse(progress)
+        response['Cache-Control'] = 'no-cache'
+        return response
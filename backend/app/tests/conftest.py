@@ -15,6 +15,7 @@ from server.server_registration import (
     ServerPasswordResetInfo,
     ServerDeletedInfo,
     ExecutionMessage,
+    ListServersMixin,
     ServerState,
     RestartServerMixin,
     ResetPasswordMixin,
@@ -126,6 +127,32 @@ def extended_dummy_server_type(
     ServerTypeFactory.remove(server_type_name)
 
 
+@pytest.fixture
+def listing_dummy_server_type(
+    dummy_server_created_info, dummy_server_info, dummy_server_deletion_info
+) -> Iterator[str]:
+    server_type_name = 'listing_test_dummy_server'
+
+    @ServerTypeFactory.register(server_type_name)
+    class ListingDummyServerType(ServerTypeBase, ListServersMixin):
+        listed_servers: list[ServerInfo] = []
+
+        def create_instance(self, model_instance_id, *args, **kwargs) -> ServerCreatedInfo:
+            return dummy_server_created_info
+
+        def get_server_info(self, model_instance_id, *args, **kwargs) -> ServerInfo:
+            return dummy_server_info
+
+        def list_servers(self, *args, **kwargs) -> list[ServerInfo]:
+            return self.listed_servers
+
+        def delete_server(self, model_instance_id, *args, **kwargs) -> ServerDeletedInfo:
+            return dummy_server_deletion_info
+
+    yield server_type_name
+    ServerTypeFactory.remove(server_type_name)
+
+
 @pytest.fixture
 def dummy_active_server_type(dummy_server_type, django_user_model):
     server_type = ServerType(
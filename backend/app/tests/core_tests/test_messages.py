@@ -0,0 +1,139 @@
+from asgiref.sync import async_to_sync
+from django.contrib.messages import constants as message_constants
+from django.core.cache import cache
+from django.urls import reverse
+
+import pytest
+
+from user_messages import api  # type: ignore[import]
+
+import core.views
+from core.message_versions import (
+    get_message_version,
+    get_or_start_message_version,
+    message_version_key,
+)
+
+
+@pytest.mark.django_db
+def test_add_message_bumps_version(django_user_model):
+    user = django_user_model.objects.create(username='message-user')
+    version = get_or_start_message_version(user.id)
+
+    api.add_message(
+        user=user, level=message_constants.INFO, message='first message'
+    )
+    api.add_message(
+        user=user, level=message_constants.INFO, message='second message'
+    )
+
+    assert get_message_version(user.id) == version + 2
+
+
+@pytest.mark.django_db
+def test_message_stream_disabled(client, django_user_model, settings):
+    settings.USER_MESSAGES_PUSH = False
+    user = django_user_model.objects.create(username='message-user')
+    client.force_login(user)
+
+    response = client.get(reverse('core:user-messages-stream'))
+    assert response.status_code == 404
+
+
+@pytest.mark.django_db
+def test_message_stream_needs_login(client, settings):
+    settings.USER_MESSAGES_PUSH = True
+
+    response = client.get(reverse('core:user-messages-stream'))
+    assert response.status_code == 404
+
+
+@pytest.mark.django_db
+def test_message_stream_pushes_messages(
+    client, django_user_model, settings, monkeypatch
+):
+    monkeypatch.setattr('core.views.STREAM_DURATION', 0.3)
+    monkeypatch.setattr('core.views.STREAM_CHECK_INTERVAL', 0.1)
+    settings.USER_MESSAGES_PUSH = True
+    user = django_user_model.objects.create(username='message-user')
+    client.force_login(user)
+    api.add_message(
+        user=user, level=message_constants.INFO, message='pushed message'
+    )
+
+    response = client.get(reverse('core:user-messages-stream'))
+    assert response['Content-Type'] == 'text/event-stream'
+
+    async def read_stream():
+        return [chunk async for chunk in response.streaming_content]
+
+    content = b''.join(async_to_sync(read_stream)()).decode()
+
+    assert content.count('event: user-messages') == 1
+    assert 'pushed message' in content
+
+
+@pytest.mark.django_db
+def test_message_stream_renders_once_without_cached_version(
+    client, django_user_model, settings, monkeypatch
+):
+    monkeypatch.setattr('core.views.STREAM_DURATION', 0.3)
+    monkeypatch.setattr('core.views.STREAM_CHECK_INTERVAL', 0.05)
+    settings.USER_MESSAGES_PUSH = True
+    user = django_user_model.objects.create(username='message-user')
+    client.force_login(user)
+    api.add_message(
+        user=user, level=message_constants.INFO, message='pushed message'
+    )
+    # e.g. evicted from the cache
+    cache.delete(message_version_key(user.id))
+    renders = []
+    render_user_messages = core.views._render_user_messages
+    monkeypatch.setattr(
+        'core.views._render_user_messages',
+        lambda user: renders.append(user) or render_user_messages(user),
+    )
+
+    response = client.get(reverse('core:user-messages-stream'))
+
+    async def read_stream():
+        return [chunk async for chunk in response.streaming_content]
+
+    content = b''.join(async_to_sync(read_stream)()).decode()
+
+    assert content.count('event: user-messages') == 1
+    assert len(renders) == 1
+    assert get_message_version(user.id) is not None
+
+
+@pytest.mark.django_db
+def test_messages_snippet_not_modified(
+    client, django_user_model, django_assert_max_num_queries
+):
+    user = django_user_model.objects.create(username='message-user')
+    client.force_login(user)
+    api.add_message(
+        user=user, level=message_constants.INFO, message='first message'
+    )
+
+    response = client.get(reverse('core:user-messages-snippet'))
+    assert response.status_code == 200
+    assert 'first message' in response.content.decode()
+    etag = response['ETag']
+
+    # only the session and the user are loaded
+    with django_assert_max_num_queries(2):
+        response = client.get(
+            reverse('core:user-messages-snippet'), HTTP_IF_NONE_MATCH=etag
+        )
+    assert response.status_code == 304
+
+    api.add_message(
+        user=user, level=message_constants.INFO, message='second message'
+    )
+    response = client.get(
+        reverse('core:user-messages-snippet'), HTTP_IF_NONE_MATCH=etag
+    )
+    assert response.status_code == 200
+    assert 'second message' in response.content.decode()
+    assert response['ETag'] != etag
@@ -0,0 +1,180 @@
+from types import SimpleNamespace
+
+import pytest
+
+from hcloud.actions.domain import ActionFailedException  # type: ignore[import]
+
+from server.providers.hetzner import base
+
+
+class DummyAction:
+    def __init__(self, statuses):
+        self.id = 1
+        self.command = 'dummy_action'
+        self.error = None
+        self._statuses = list(statuses)
+        self.status = self._statuses.pop(0)
+        self.reloads = 0
+
+    def reload(self):
+        self.reloads += 1
+        self.status = self._statuses.pop(0)
+
+
+@pytest.fixture
+def recorded_sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(base, 'sleep', sleeps.append)
+    return sleeps
+
+
+def test_wait_for_action_backs_off_until_done(recorded_sleeps):
+    action = DummyAction(['running'] * 5 + ['success'])
+
+    assert base._wait_for_action(action) is True
+    assert action.reloads == 5
+    assert recorded_sleeps == [1, 2, 4, 8, 8]
+
+
+def test_wait_for_action_finished_does_not_sleep(recorded_sleeps):
+    action = DummyAction(['success'])
+
+    assert base._wait_for_action(action) is True
+    assert recorded_sleeps == []
+
+
+def test_wait_for_action_gives_up_after_timeout(monkeypatch, recorded_sleeps):
+    monkeypatch.setattr(base, 'HCLOUD_ACTION_TIMEOUT', 0)
+    action = DummyAction(['running', 'success'])
+
+    assert base._wait_for_action(action) is False
+    assert action.reloads == 0
+
+
+def test_wait_for_action_raises_on_error(recorded_sleeps):
+    action = DummyAction(['running', 'error'])
+
+    with pytest.raises(ActionFailedException):
+        base._wait_for_action(action)
+
+
+def test_client_registry_reuses_client():
+    registry = base.HetznerClientRegistry(token='dummy-token')
+
+    client = registry.get_client()
+    assert registry.get_client() is client
+    assert registry.stats()['clients_created'] == 1
+    assert registry.stats()['clients_reused'] == 1
+
+
+def test_client_registry_creates_new_client_after_fork(monkeypatch):
+    registry = base.HetznerClientRegistry(token='dummy-token')
+    client = registry.get_client()
+
+    monkeypatch.setattr(base.os, 'getpid', lambda: -1)
+    assert registry.get_client() is not client
+    assert registry.stats()['clients_reused'] == 0
+
+
+class DummyLookupClient:
+    class images:
+        calls = 0
+
+        @classmethod
+        def get_all(cls, type):
+            cls.calls += 1
+            return [
+                SimpleNamespace(id=1, description='other'),
+                SimpleNamespace(id=2, description='dummy-image'),
+            ]
+
+    class locations:
+        @staticmethod
+        def get_by_name(name):
+            return SimpleNamespace(id=3, name=name)
+
+
+@pytest.fixture
+def dummy_lookup_client(monkeypatch):
+    monkeypatch.setattr(
+        base.client_registry, 'get_client', lambda: DummyLookupClient
+    )
+    DummyLookupClient.images.calls = 0
+    base.invalidate_image_and_location('dummy-image', 'dummy-location')
+    yield DummyLookupClient
+    base.invalidate_image_and_location('dummy-image', 'dummy-location')
+
+
+def test_resolve_image_and_location_is_cached(dummy_lookup_client):
+    ids = base.resolve_image_and_location('dummy-image', 'dummy-location')
+    assert ids == (2, 3)
+    assert base.resolve_image_and_location(
+        'dummy-image', 'dummy-location'
+    ) == (2, 3)
+    assert dummy_lookup_client.images.calls == 1
+
+    base.invalidate_image_and_location('dummy-image', 'dummy-location')
+    base.resolve_image_and_location('dummy-image', 'dummy-location')
+    assert dummy_lookup_client.images.calls == 2
+
+
+def test_resolve_image_and_location_unknown_image(dummy_lookup_client):
+    with pytest.raises(ValueError):
+        base.resolve_image_and_location('missing-image', 'dummy-location')
+
+
+class DummyCreateClient:
+    class servers:
+        statuses = ['initializing']
+
+        @classmethod
+        def create(cls, **kwargs):
+            return SimpleNamespace(
+                server=cls.get_by_id(42),
+                root_password='warm-password',
+                action=DummyAction(['running', 'success']),
+                next_actions=[DummyAction(['running', 'success'])],
+            )
+
+        @classmethod
+        def get_by_id(cls, server_id):
+            return SimpleNamespace(
+                id=server_id,
+                name='warm-name',
+                status=cls.statuses.pop(0),
+                created=None,
+                public_net=None,
+                labels={},
+            )
+
+
+@pytest.mark.django_db
+def test_warm_server_can_be_claimed(monkeypatch, recorded_sleeps):
+    from django.db import transaction
+
+    from server.models import ServerType, WarmServer
+    from server.server_registration import ServerState
+    from server.tasks import create_warm_server
+
+    monkeypatch.setattr(
+        base.client_registry, 'get_client', lambda: DummyCreateClient
+    )
+    monkeypatch.setattr(
+        base, 'resolve_image_and_location', lambda *args: (1, None)
+    )
+    DummyCreateClient.servers.statuses = ['initializing', 'running']
+    server_type = ServerType.objects.create(
+        name='warm-hetzner',
+        server_type_reference='hetzner-linux-server',
+        warm_pool_size=1,
+    )
+    warm_server = WarmServer.objects.create(server_type=server_type)
+
+    create_warm_server(warm_server_id=warm_server.id)
+
+    with transaction.atomic():
+        claimed = WarmServer.claim(server_type)
+    assert claimed.server_id == '42'
+    assert claimed.server_state == ServerState.RUNNING.value
+    assert claimed.server_password == 'warm-password'
+    assert not WarmServer.objects.exists()
@@ -1,13 +1,58 @@
+from dataclasses import replace
+from datetime import timedelta
+import gzip
+import json
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import EmailMessage
 from django.utils import timezone
 
+import celery
+from celery_progress.backend import PROGRESS_STATE
 import pytest
 
+from server.models import (
+    BulkActionJob,
+    ExecutionLease,
+    ExecutionMessages,
+    InstanceActionLease,
+    ProvisionedServerInstance,
+    ServerType,
+    WarmServer,
+)
 from server.server_registration import (
     ExecutionMessage,
     ServerInfo,
     ServerState,
+    ServerTypeFactory,
+)
+from server.tasks import (
+    CLEANUP_CHUNK_SIZE,
+    _enqueue_deletions,
+    acquire_execution_slot,
+    acquire_instance_turn,
+    _enqueue_lease_key,
+    add_message_content_to_server_instance,
+    enqueue_bulk_action,
+    prolong_server,
+    prune_execution_messages,
+    reap_execution_leases,
+    notify_due_server,
+    release_execution_slot,
+    release_instance_turn,
+    remove_due_server,
+    run_schedule_due_jobs,
+    schedule_due_jobs,
+    send_next_bulk_job,
+    send_info_mail,
+    start_server,
+    run_cleanup,
+    run_info_mail_send,
+    run_server_state_sync,
 )
-from server.tasks import add_message_content_to_server_instance
 
 
 @pytest.fixture
@@ -68,3 +113,833 @@ def test_add_message_content_to_server_instance(
     user_messages = instance.user_messages()
     assert user_messages.count() == 1
     assert user_messages[0].user_message == new_info.message.user_message
+
+
+@pytest.mark.django_db
+def test_add_message_content_keeps_concurrent_changes(
+    dummy_task_name,
+    dummy_server_info,
+    dummy_provisioned_server_instance,
+):
+    instance = dummy_provisioned_server_instance
+    prolonged = instance.removal_at + timedelta(days=7)
+    # e.g. the user prolongs the server while the job runs
+    ProvisionedServerInstance.objects.filter(pk=instance.pk).update(
+        removal_at=prolonged
+    )
+
+    add_message_content_to_server_instance(
+        dummy_task_name,
+        'dummy-test-run-id',
+        replace(dummy_server_info, server_name='new-name'),
+        instance,
+    )
+
+    instance.refresh_from_db()
+    assert instance.server_name == 'new-name'
+    assert instance.removal_at == prolonged
+    assert instance.executionmessages_set.count() == 1
+
+
+@pytest.mark.django_db
+@patch('server.models.tasks.create_server.delay')
+def test_run_server_state_sync(
+    create_server_mock,
+    listing_dummy_server_type,
+    dummy_server_info,
+    django_user_model,
+):
+    server_type = ServerType.objects.create(
+        name='listing-server-type',
+        description='A listing dummy server type',
+        server_type_reference=listing_dummy_server_type,
+    )
+    user = django_user_model.objects.create(username='sync-user')
+    instance = ProvisionedServerInstance.objects.create(
+        server_type=server_type,
+        user=user,
+        server_id=dummy_server_info.server_id,
+    )
+    not_listed_instance = ProvisionedServerInstance.objects.create(
+        server_type=server_type,
+        user=django_user_model.objects.create(username='other-user'),
+        server_id='not-listed',
+    )
+
+    server_class = ServerTypeFactory.registry[listing_dummy_server_type]
+    server_class.listed_servers = [
+        replace(
+            dummy_server_info,
+            server_state=ServerState.STOPPED,
+            server_address='1.2.3.4',
+            server_name='synced-name',
+        )
+    ]
+    assert run_server_state_sync() == 1
+
+    instance.refresh_from_db()
+    assert instance.server_state == ServerState.STOPPED.value
+    assert instance.server_address == '1.2.3.4'
+    assert instance.server_name == 'synced-name'
+
+    not_listed_instance.refresh_from_db()
+    assert not_listed_instance.server_state == ServerState.UNKNOWN.value
+
+    # nothing changed since the last run
+    assert run_server_state_sync() == 0
+
+
+@pytest.mark.django_db
+def test_run_server_state_sync_lists_each_variant_once(
+    listing_dummy_server_type,
+):
+    server_class = ServerTypeFactory.registry[listing_dummy_server_type]
+    # the same implementation registered a second time
+    other_reference = 'other_listing_test_dummy_server'
+    ServerTypeFactory.register(other_reference)(server_class)
+    for name, reference in (
+        ('listing-server-type', listing_dummy_server_type),
+        ('other-listing-server-type', other_reference),
+    ):
+        ServerType.objects.create(
+            name=name,
+            description='A listing dummy server type',
+            server_type_reference=reference,
+        )
+
+    try:
+        with patch.object(
+            server_class, 'list_servers', return_value=[]
+        ) as list_servers_mock:
+            run_server_state_sync()
+    finally:
+        ServerTypeFactory.remove(other_reference)
+    list_servers_mock.assert_called_once()
+
+
+@pytest.mark.django_db
+def test_run_server_state_sync_readies_warm_servers(
+    listing_dummy_server_type,
+    dummy_server_info,
+):
+    server_type = ServerType.objects.create(
+        name='listing-server-type',
+        description='A listing dummy server type',
+        server_type_reference=listing_dummy_server_type,
+    )
+    warm_server = WarmServer.objects.create(
+        server_type=server_type,
+        server_id=dummy_server_info.server_id,
+    )
+    server_class = ServerTypeFactory.registry[listing_dummy_server_type]
+    server_class.listed_servers = [dummy_server_info]
+
+    assert run_server_state_sync() == 1
+
+    warm_server.refresh_from_db()
+    assert warm_server.server_state == ServerState.RUNNING.value
+
+
+@pytest.mark.django_db
+def test_run_cleanup_claims_due_instances_once(
+    dummy_provisioned_server_instance,
+    django_capture_on_commit_callbacks,
+):
+    instance = dummy_provisioned_server_instance
+    ProvisionedServerInstance.objects.filter(id=instance.id).update(
+        removal_at=timezone.now() - timedelta(minutes=1)
+    )
+
+    with patch('server.tasks._enqueue_deletions') as enqueue_mock:
+        with django_capture_on_commit_callbacks(execute=True):
+            run_cleanup()
+        enqueue_mock.assert_called_once_with([instance.id])
+
+        instance.refresh_from_db()
+        assert instance.server_bears_mark_of_deletion
+
+        # already claimed, the next run has nothing to do
+        with django_capture_on_commit_callbacks(execute=True):
+            run_cleanup()
+        enqueue_mock.assert_called_with([])
+
+
+@patch('server.tasks.celery.group')
+def test_enqueue_deletions_in_chunks(group_mock):
+    _enqueue_deletions(list(range(CLEANUP_CHUNK_SIZE * 2 + 1)))
+
+    chunk_sizes = [len(list(c.args[0])) for c in group_mock.call_args_list]
+    assert chunk_sizes == [CLEANUP_CHUNK_SIZE, CLEANUP_CHUNK_SIZE, 1]
+
+
+def _dummy_celery_task(job_id, instance_id):
+    return SimpleNamespace(
+        name='dummy-task',
+        request=SimpleNamespace(id=job_id, kwargs=dict(instance_id=instance_id)),
+    )
+
+
+@pytest.mark.django_db
+def test_execution_slots_wake_waiting_jobs_in_order(
+    dummy_provisioned_server_instance,
+    django_capture_on_commit_callbacks,
+):
+    instance = dummy_provisioned_server_instance
+    instance.server_type.max_paralell_executions = 1
+    instance.server_type.save()
+
+    first = _dummy_celery_task('job-1', instance.id)
+    second = _dummy_celery_task('job-2', instance.id)
+    third = _dummy_celery_task('job-3', instance.id)
+
+    assert acquire_execution_slot(first, instance)
+    assert first.request.holds_execution_slot
+    assert not acquire_execution_slot(second, instance)
+    assert not acquire_execution_slot(third, instance)
+    # still waiting, when it is delivered again
+    assert not acquire_execution_slot(third, instance)
+
+    with patch('server.tasks.celery.current_app.send_task') as send_task_mock:
+        with django_capture_on_commit_callbacks(execute=True):
+            release_execution_slot('job-1')
+        send_task_mock.assert_called_once_with(
+            'dummy-task',
+            kwargs=dict(instance_id=instance.id),
+            task_id='job-2',
+        )
+
+    # the slot has been handed over to the second job
+    assert not acquire_execution_slot(third, instance)
+    assert acquire_execution_slot(second, instance)
+    assert ExecutionLease.objects.filter(
+        state=ExecutionLease.RUNNING
+    ).count() == 1
+
+
+@pytest.mark.django_db
+def test_job_keeps_its_request(dummy_provisioned_server_instance):
+    instance = dummy_provisioned_server_instance
+    instance.server_type.max_paralell_executions = 1
+    instance.server_type.save()
+    assert acquire_execution_slot(
+        _dummy_celery_task('job-1', instance.id), instance
+    )
+    lease_key = _enqueue_lease_key(start_server.name, instance.id)
+    cache.delete(lease_key)
+
+    try:
+        start_server.apply(
+            kwargs=dict(instance_id=instance.id), task_id='waiting-job'
+        )
+        # the job waits with its own id
+        assert ExecutionLease.objects.get(job_id='waiting-job').state == (
+            ExecutionLease.WAITING
+        )
+    finally:
+        cache.delete(lease_key)
+
+
+@pytest.mark.django_db
+def test_waiting_job_is_reported_in_progress(
+    dummy_provisioned_server_instance,
+):
+    from django_celery_results.models import TaskResult
+
+    instance = dummy_provisioned_server_instance
+    instance.server_type.max_paralell_executions = 1
+    instance.server_type.save()
+    assert acquire_execution_slot(
+        _dummy_celery_task('job-1', instance.id), instance
+    )
+    lease_key = _enqueue_lease_key(start_server.name, instance.id)
+    cache.delete(lease_key)
+
+    try:
+        result = start_server.apply(
+            kwargs=dict(instance_id=instance.id), task_id='waiting-job'
+        )
+        assert result.state == celery.states.IGNORED
+        # not finished, it runs once a slot is free
+        assert TaskResult.objects.get(task_id='waiting-job').status == (
+            PROGRESS_STATE
+        )
+        assert cache.get(lease_key) == 'waiting-job'
+    finally:
+        cache.delete(lease_key)
+
+
+@pytest.mark.django_db
+def test_execution_slots_expire(dummy_provisioned_server_instance):
+    instance = dummy_provisioned_server_instance
+    instance.server_type.max_paralell_executions = 1
+    instance.server_type.save()
+
+    assert acquire_execution_slot(_dummy_celery_task('job-1', instance.id), instance)
+    ExecutionLease.objects.update(
+        expires_at=timezone.now() - timedelta(minutes=1)
+    )
+    assert acquire_execution_slot(_dummy_celery_task('job-2', instance.id), instance)
+
+
+@pytest.mark.django_db
+def test_execution_slots_unlimited(dummy_provisioned_server_instance):
+    instance = dummy_provisioned_server_instance
+
+    for job_id in ['job-1', 'job-2']:
+        assert acquire_execution_slot(
+            _dummy_celery_task(job_id, instance.id), instance
+        )
+    assert not ExecutionLease.objects.exists()
+
+
+@pytest.mark.django_db
+def test_prune_execution_messages(settings, tmp_path):
+    settings.EXECUTION_MESSAGES_RETENTION_DAYS = 30
+    settings.EXECUTION_MESSAGES_ARCHIVE_DIR = str(tmp_path)
+    for i in range(3):
+        ExecutionMessages.objects.create(
+            job_id=f'old-job-{i}',
+            task_name='dummy-task',
+            admin_trace='A trace',
+        )
+    # created can not be set on creation
+    ExecutionMessages.objects.update(
+        created=timezone.now() - timedelta(days=31)
+    )
+    ExecutionMessages.objects.create(job_id='new-job', task_name='dummy-task')
+
+    with patch('server.tasks.PRUNE_BATCH_SIZE', 2):
+        assert prune_execution_messages() == 3
+
+    assert list(
+        ExecutionMessages.objects.values_list('job_id', flat=True)
+    ) == ['new-job']
+    (archive,) = tmp_path.iterdir()
+    with gzip.open(archive, 'rt') as f:
+        rows = [json.loads(line) for line in f]
+    assert sorted(row['job_id'] for row in rows) == [
+        'old-job-0',
+        'old-job-1',
+        'old-job-2',
+    ]
+    assert rows[0]['admin_trace'] == 'A trace'
+
+
+@pytest.mark.django_db
+@patch('server.tasks.prune_execution_messages.apply_async')
+def test_prune_execution_messages_continues_later(apply_mock, settings):
+    settings.EXECUTION_MESSAGES_RETENTION_DAYS = 30
+    settings.EXECUTION_MESSAGES_ARCHIVE_DIR = ''
+    for i in range(3):
+        ExecutionMessages.objects.create(
+            job_id=f'old-job-{i}', task_name='dummy-task'
+        )
+    ExecutionMessages.objects.update(
+        created=timezone.now() - timedelta(days=31)
+    )
+
+    with patch('server.tasks.PRUNE_BATCH_SIZE', 1), patch(
+        'server.tasks.PRUNE_MAX_BATCHES', 2
+    ):
+        assert prune_execution_messages() == 2
+    assert ExecutionMessages.objects.count() == 1
+    apply_mock.assert_called_once_with(countdown=60)
+
+
+@pytest.mark.django_db
+def test_prune_execution_messages_disabled(settings):
+    settings.EXECUTION_MESSAGES_RETENTION_DAYS = 0
+    ExecutionMessages.objects.create(job_id='old-job', task_name='dummy-task')
+    ExecutionMessages.objects.update(
+        created=timezone.now() - timedelta(days=3650)
+    )
+
+    assert prune_execution_messages() == 0
+    assert ExecutionMessages.objects.count() == 1
+
+
+@pytest.fixture
+def due_for_info_mail(dummy_active_server_type, django_user_model):
+    dummy_active_server_type.prolong_by_days = 30
+    dummy_active_server_type.save()
+    instances = []
+    for name in ['first', 'second', 'third']:
+        user = django_user_model.objects.create(
+            username=name, email=f'{name}@example.com'
+        )
+        with patch('server.models.tasks.create_server.delay'):
+            instances.append(
+                ProvisionedServerInstance.objects.create(
+                    server_type=dummy_active_server_type, user=user
+                )
+            )
+    ProvisionedServerInstance.objects.update(notify_before_destroy=True)
+    return instances
+
+
+@pytest.mark.django_db
+def test_run_info_mail_send(
+    due_for_info_mail, django_capture_on_commit_callbacks
+):
+    send = EmailMessage.send
+
+    def fail_for_second(message, *args, **kwargs):
+        if message.to == ['second@example.com']:
+            raise ConnectionError('hiccup')
+        return send(message, *args, **kwargs)
+
+    with patch.object(EmailMessage, 'send', fail_for_second), patch(
+        'server.tasks.send_info_mail.apply_async'
+    ) as retry_mock:
+        with django_capture_on_commit_callbacks(execute=True):
+            assert run_info_mail_send() == 2
+
+    assert sorted(message.to[0] for message in mail.outbox) == [
+        'first@example.com',
+        'third@example.com',
+    ]
+    second = due_for_info_mail[1]
+    retry_mock.assert_called_once_with(
+        kwargs=dict(instance_id=second.id), countdown=60
+    )
+    for instance in ProvisionedServerInstance.objects.all():
+        # the retry marks it sent, once it was
+        assert instance.info_mail_sent == (instance.id != second.id)
+        assert (instance.extending_lifetime_secret is None) == (
+            instance.id == second.id
+        )
+    assert str(
+        ProvisionedServerInstance.objects.get(
+            id=due_for_info_mail[0].id
+        ).extending_lifetime_secret
+    ) in mail.outbox[0].body + mail.outbox[1].body
+
+    # nothing left to send, the retry owns the failed one
+    assert run_info_mail_send() == 0
+
+    # the retry got lost
+    ProvisionedServerInstance.objects.filter(id=second.id).update(
+        info_mail_claimed_until=timezone.now() - timedelta(seconds=1)
+    )
+    assert run_info_mail_send() == 1
+    assert mail.outbox[-1].to == ['second@example.com']
+
+
+@pytest.mark.django_db
+def test_run_info_mail_send_without_prolonging(due_for_info_mail):
+    ServerType.objects.update(prolong_by_days=None)
+
+    assert run_info_mail_send() == 0
+    assert mail.outbox == []
+
+
+@pytest.mark.django_db
+def test_send_info_mail_falls_back_to_admins(due_for_info_mail):
+    instance = due_for_info_mail[0]
+    with patch.object(
+        EmailMessage, 'send', side_effect=ConnectionError('hiccup')
+    ), patch.object(send_info_mail, 'max_retries', 0), patch(
+        'server.tasks.mail_admins'
+    ) as mail_admins_mock:
+        assert send_info_mail(instance_id=instance.id) is False
+    mail_admins_mock.assert_called_once()
+    # the link sent to the admins works
+    instance.refresh_from_db()
+    assert instance.info_mail_sent
+    assert str(instance.extending_lifetime_secret) in (
+        mail_admins_mock.call_args.kwargs['message']
+    )
+
+    assert send_info_mail(instance_id=instance.id) is True
+    assert mail.outbox[0].to == ['first@example.com']
+
+
+@pytest.mark.django_db
+@patch('server.tasks.notify_due_server.apply_async')
+@patch('server.tasks.remove_due_server.apply_async')
+def test_schedule_due_jobs(
+    remove_mock, notify_mock, dummy_provisioned_server_instance
+):
+    instance = dummy_provisioned_server_instance
+    schedule_due_jobs(instance)
+    remove_mock.assert_not_called()
+
+    instance.removal_at = timezone.now() + timedelta(minutes=5)
+    instance.notify_before_destroy = True
+    schedule_due_jobs(instance)
+    remove_mock.assert_called_once_with(
+        kwargs=dict(instance_id=instance.id), eta=instance.removal_at
+    )
+    # the mail is due already, it is sent right away
+    assert notify_mock.call_args.kwargs['eta'] <= timezone.now()
+
+
+@pytest.mark.django_db
+@patch('server.tasks.schedule_due_jobs')
+def test_run_schedule_due_jobs(
+    schedule_mock, dummy_provisioned_server_instance
+):
+    assert run_schedule_due_jobs() == 0
+
+    ProvisionedServerInstance.objects.update(
+        removal_at=timezone.now() + timedelta(minutes=10)
+    )
+    assert run_schedule_due_jobs() == 1
+    assert (
+        schedule_mock.call_args.args[0].id
+        == dummy_provisioned_server_instance.id
+    )
+
+
+@pytest.mark.django_db
+@patch('server.tasks.delete_server.delay')
+def test_remove_due_server(delete_mock, dummy_provisioned_server_instance):
+    instance = dummy_provisioned_server_instance
+    # prolonged in the meantime
+    assert remove_due_server(instance_id=instance.id) is False
+
+    ProvisionedServerInstance.objects.update(removal_at=timezone.now())
+    assert remove_due_server(instance_id=instance.id) is True
+    delete_mock.assert_called_once_with(instance_id=instance.id)
+    # claimed already
+    assert remove_due_server(instance_id=instance.id) is False
+
+
+@pytest.mark.django_db
+@patch('server.tasks.send_info_mail.delay')
+def test_notify_due_server(send_mock, due_for_info_mail):
+    instance = due_for_info_mail[0]
+    assert notify_due_server(instance_id=instance.id) is True
+    send_mock.assert_called_once_with(instance_id=instance.id)
+    assert notify_due_server(instance_id=instance.id) is False
+
+
+@pytest.fixture
+def enqueue_lease():
+    key = _enqueue_lease_key(start_server.name, 4711)
+    cache.delete(key)
+    yield key
+    cache.delete(key)
+
+
+@pytest.mark.django_db
+@patch.object(celery.Task, 'apply_async')
+def test_enqueue_is_deduplicated(apply_async_mock, enqueue_lease):
+    first = start_server.delay(instance_id=4711)
+    second = start_server.delay(instance_id=4711)
+
+    apply_async_mock.assert_called_once()
+    first_id = apply_async_mock.call_args.args[2]
+    assert second.id == first_id
+    assert cache.get(enqueue_lease) == first_id
+
+    # a retry keeps its id and is sent again
+    start_server.apply_async(kwargs=dict(instance_id=4711), task_id=first_id)
+    assert apply_async_mock.call_count == 2
+
+    # done, the next call is enqueued
+    start_server.after_return(
+        'SUCCESS', None, first_id, (), dict(instance_id=4711), None
+    )
+    start_server.delay(instance_id=4711)
+    assert apply_async_mock.call_count == 3
+    assert apply_async_mock.call_args.args[2] != first_id
+
+
+@pytest.mark.django_db
+def test_duplicate_is_skipped_when_it_runs(enqueue_lease):
+    cache.set(enqueue_lease, 'first-job')
+
+    # the job would fail without an instance, if it was not skipped
+    result = start_server.apply(
+        kwargs=dict(instance_id=4711), task_id='duplicate-job'
+    )
+    assert result.successful()
+    assert result.result is None
+    assert cache.get(enqueue_lease) == 'first-job'
+
+
+@pytest.mark.django_db
+def test_skipped_duplicate_gives_back_its_slot(
+    dummy_provisioned_server_instance,
+):
+    instance = dummy_provisioned_server_instance
+    instance.server_type.max_paralell_executions = 1
+    instance.server_type.save()
+    # woken after waiting, then a copy took over its enqueue lease
+    assert acquire_execution_slot(
+        _dummy_celery_task('woken-job', instance.id), instance
+    )
+    lease_key = _enqueue_lease_key(start_server.name, instance.id)
+    cache.set(lease_key, 'other-job')
+
+    try:
+        start_server.apply(
+            kwargs=dict(instance_id=instance.id), task_id='woken-job'
+        )
+    finally:
+        cache.delete(lease_key)
+    assert not ExecutionLease.objects.exists()
+
+
+@pytest.mark.django_db
+def test_reaper_keeps_enqueue_lease_of_waiting_jobs(
+    dummy_provisioned_server_instance,
+):
+    instance = dummy_provisioned_server_instance
+    instance.server_type.max_paralell_executions = 1
+    instance.server_type.save()
+    kwargs = dict(instance_id=instance.id)
+    lease_key = _enqueue_lease_key(start_server.name, instance.id)
+    ExecutionLease.objects.create(
+        server_type=instance.server_type,
+        job_id='waiting-job',
+        task_name=start_server.name,
+        task_kwargs=kwargs,
+        state=ExecutionLease.WAITING,
+    )
+    # e.g. expired while it waited
+    cache.delete(lease_key)
+
+    try:
+        reap_execution_leases()
+        assert cache.get(lease_key) == 'waiting-job'
+    finally:
+        cache.delete(lease_key)
+
+
+@pytest.mark.django_db
+def test_instance_turns_in_order(
+    dummy_provisioned_server_instance,
+    django_capture_on_commit_callbacks,
+    django_user_model,
+):
+    instance = dummy_provisioned_server_instance
+    start = _dummy_celery_task('start-job', instance.id)
+    stop = _dummy_celery_task('stop-job', instance.id)
+    reboot = _dummy_celery_task('reboot-job', instance.id)
+
+    assert acquire_instance_turn(start, instance.id)
+    assert start.request.holds_instance_turn
+    assert not acquire_instance_turn(stop, instance.id)
+    assert not acquire_instance_turn(reboot, instance.id)
+    # still waiting, when it is delivered again
+    assert not acquire_instance_turn(reboot, instance.id)
+
+    # other instances are not affected
+    other_instance = ProvisionedServerInstance.objects.create(
+        server_type=instance.server_type,
+        user=django_user_model.objects.create(username='other-user'),
+    )
+    assert acquire_instance_turn(
+        _dummy_celery_task('other-job', other_instance.id), other_instance.id
+    )
+
+    with patch('server.tasks.celery.current_app.send_task') as send_task_mock:
+        with django_capture_on_commit_callbacks(execute=True):
+            release_instance_turn('start-job')
+        # the job which arrived first is next
+        send_task_mock.assert_called_once_with(
+            'dummy-task',
+            kwargs=dict(instance_id=instance.id),
+            task_id='stop-job',
+        )
+
+    assert not acquire_instance_turn(reboot, instance.id)
+    assert acquire_instance_turn(stop, instance.id)
+
+
+@pytest.mark.django_db
+def test_deleted_instance_wakes_waiting_jobs(
+    dummy_provisioned_server_instance,
+    django_capture_on_commit_callbacks,
+):
+    instance = dummy_provisioned_server_instance
+    assert acquire_instance_turn(
+        _dummy_celery_task('delete-job', instance.id), instance.id
+    )
+    assert not acquire_instance_turn(
+        _dummy_celery_task('stop-job', instance.id), instance.id
+    )
+
+    with patch('server.tasks.celery.current_app.send_task') as send_task_mock:
+        with django_capture_on_commit_callbacks(execute=True):
+            ProvisionedServerInstance.objects.filter(id=instance.id).delete()
+        # it runs, finds the instance gone and finishes
+        send_task_mock.assert_called_once_with(
+            'dummy-task',
+            kwargs=dict(instance_id=instance.id),
+            task_id='stop-job',
+        )
+    assert not InstanceActionLease.objects.exists()
+    assert acquire_instance_turn(
+        _dummy_celery_task('stop-job', instance.id), instance.id
+    )
+
+
+@pytest.mark.django_db
+def test_instance_turns_expire(dummy_provisioned_server_instance):
+    instance = dummy_provisioned_server_instance
+
+    assert acquire_instance_turn(
+        _dummy_celery_task('job-1', instance.id), instance.id
+    )
+    InstanceActionLease.objects.update(
+        expires_at=timezone.now() - timedelta(minutes=1)
+    )
+    assert acquire_instance_turn(
+        _dummy_celery_task('job-2', instance.id), instance.id
+    )
+
+
+@pytest.mark.django_db
+def test_waiting_for_slot_keeps_instance_turn(
+    dummy_provisioned_server_instance,
+):
+    instance = dummy_provisioned_server_instance
+    instance.server_type.max_paralell_executions = 1
+    instance.server_type.save()
+    assert acquire_execution_slot(
+        _dummy_celery_task('job-1', instance.id), instance
+    )
+    lease_key = _enqueue_lease_key(start_server.name, instance.id)
+    cache.delete(lease_key)
+
+    try:
+        start_server.apply(
+            kwargs=dict(instance_id=instance.id), task_id='waiting-job'
+        )
+    finally:
+        cache.delete(lease_key)
+
+    # a stop after the waiting start still waits for it
+    turn = InstanceActionLease.objects.get(job_id='waiting-job')
+    assert turn.state == InstanceActionLease.RUNNING
+    assert not acquire_instance_turn(
+        _dummy_celery_task('stop-job', instance.id), instance.id
+    )
+
+    # kept as long as the job waits for its slot
+    InstanceActionLease.objects.filter(job_id='waiting-job').update(
+        expires_at=timezone.now() - timedelta(minutes=1)
+    )
+    reap_execution_leases()
+    turn.refresh_from_db()
+    assert turn.expires_at > timezone.now()
+
+    # but not when the job got lost
+    ExecutionLease.objects.filter(job_id='waiting-job').delete()
+    InstanceActionLease.objects.filter(job_id='waiting-job').update(
+        expires_at=timezone.now() - timedelta(minutes=1)
+    )
+    with patch('server.tasks.celery.current_app.send_task'):
+        reap_execution_leases()
+    assert not InstanceActionLease.objects.filter(
+        job_id='waiting-job'
+    ).exists()
+
+
+@pytest.mark.django_db
+@patch('server.tasks.BULK_ACTION_PARALLELISM', 2)
+@patch('server.tasks._send_bulk_job')
+def test_bulk_action_limits_parallel_jobs(
+    send_mock, django_capture_on_commit_callbacks
+):
+    with django_capture_on_commit_callbacks(execute=True):
+        result = enqueue_bulk_action('start', [1, 2, 3])
+    job_ids = [job.id for job in result.results]
+    assert [c.args[2:] for c in send_mock.call_args_list] == [
+        (job_ids[0], 1),
+        (job_ids[1], 2),
+    ]
+
+    # every finished job enqueues the next one
+    with django_capture_on_commit_callbacks(execute=True):
+        send_next_bulk_job(job_ids[0])
+    assert send_mock.call_args.args == (
+        start_server.name, result.id, job_ids[2], 3
+    )
+    with django_capture_on_commit_callbacks(execute=True):
+        send_next_bulk_job(job_ids[1])
+        send_next_bulk_job(job_ids[2])
+    assert send_mock.call_count == 3
+    assert not BulkActionJob.objects.exists()
+
+
+@pytest.mark.django_db
+@patch('server.tasks.BULK_ACTION_PARALLELISM', 1)
+@patch('server.tasks._send_bulk_job')
+def test_stalled_bulk_action_is_resumed(
+    send_mock, django_capture_on_commit_callbacks
+):
+    from django_celery_results.models import TaskResult
+
+    with django_capture_on_commit_callbacks(execute=True):
+        result = enqueue_bulk_action('start', [1, 2, 3])
+    job_ids = [job.id for job in result.results]
+    # the first job finished, but the next one was not sent
+    TaskResult.objects.store_result(
+        'application/json', 'utf-8', job_ids[0], '{}', 'SUCCESS'
+    )
+
+    with django_capture_on_commit_callbacks(execute=True):
+        reap_execution_leases()
+    assert send_mock.call_args.args[2:] == (job_ids[1], 2)
+
+    # the second one hangs
+    BulkActionJob.objects.filter(job_id=job_ids[1]).update(
+        sent_at=timezone.now() - timedelta(days=2)
+    )
+    with django_capture_on_commit_callbacks(execute=True):
+        reap_execution_leases()
+    assert send_mock.call_args.args[2:] == (job_ids[2], 3)
+    assert send_mock.call_count == 3
+
+
+@pytest.mark.django_db
+@patch('server.tasks._enqueue_deletions')
+@patch('server.tasks._send_bulk_job')
+def test_bulk_delete_is_not_retried_by_cleanup_right_away(
+    send_mock,
+    enqueue_mock,
+    dummy_provisioned_server_instance,
+    django_capture_on_commit_callbacks,
+):
+    instance = dummy_provisioned_server_instance
+    ProvisionedServerInstance.objects.filter(id=instance.id).update(
+        modified=timezone.now() - timedelta(days=1)
+    )
+
+    enqueue_bulk_action('delete', [instance.id])
+    with django_capture_on_commit_callbacks(execute=True):
+        run_cleanup()
+    enqueue_mock.assert_called_once_with([])
+
+
+@pytest.mark.django_db
+@patch('server.tasks.schedule_due_jobs')
+def test_prolong_server_keeps_concurrent_changes(
+    schedule_mock, dummy_provisioned_server_instance
+):
+    instance = dummy_provisioned_server_instance
+    instance.server_type.prolong_by_days = 7
+    instance.server_type.save()
+    removal_at = instance.removal_at
+
+    def stale_server_obj(instance_id):
+        server_instance = ProvisionedServerInstance.objects.get(
+            pk=instance_id
+        )
+        # changed after the job loaded the instance
+        ProvisionedServerInstance.objects.filter(pk=instance_id).update(
+            server_password='changed-password'
+        )
+        return server_instance
+
+    with patch('server.tasks._get_server_obj', stale_server_obj):
+        prolong_server(instance_id=instance.id)
+
+    instance.refresh_from_db()
+    assert instance.removal_at == removal_at + timedelta(days=7)
+    assert instance.server_password == 'changed-password'
+    schedule_mock.assert_called_once()
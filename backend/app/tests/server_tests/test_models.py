@@ -0,0 +1,230 @@
+from unittest.mock import patch
+
+from django.contrib.auth.models import Group
+from django.db import IntegrityError
+
+import pytest
+
+from server.models import (
+    ExecutionMessages,
+    ExecutionTrace,
+    ProvisionedServerInstance,
+    ServerType,
+    WarmServer,
+)
+from server.server_registration import ServerState
+from server.tasks import ErrorCatcher
+
+
+@pytest.fixture
+def ready_warm_server(dummy_active_server_type):
+    dummy_active_server_type.warm_pool_size = 1
+    dummy_active_server_type.save()
+    return WarmServer.objects.create(
+        server_type=dummy_active_server_type,
+        server_id='warm-id',
+        server_name='warm-name',
+        server_address='1.2.3.4',
+        server_user='root',
+        server_password='warm-password',
+        server_state=ServerState.RUNNING.value,
+    )
+
+
+@pytest.mark.django_db
+@patch('server.models.tasks.top_up_warm_pools.delay')
+@patch('server.models.tasks.assign_server.delay')
+@patch('server.models.tasks.create_server.delay')
+def test_creation_claims_warm_server(
+    create_server_mock,
+    assign_server_mock,
+    top_up_mock,
+    ready_warm_server,
+    dummy_active_server_type,
+    django_user_model,
+):
+    user = django_user_model.objects.create(username='warm-user')
+    instance = ProvisionedServerInstance.objects.create(
+        server_type=dummy_active_server_type, user=user
+    )
+
+    create_server_mock.assert_not_called()
+    assign_server_mock.assert_called_once_with(instance_id=instance.id)
+    top_up_mock.assert_called_once()
+    assert not WarmServer.objects.exists()
+
+    instance.refresh_from_db()
+    assert instance.server_id == 'warm-id'
+    assert instance.server_password == 'warm-password'
+    assert instance.server_state == ServerState.RUNNING.value
+
+
+@pytest.mark.django_db
+@patch('server.models.tasks.assign_server.delay')
+@patch('server.models.tasks.create_server.delay')
+def test_creation_without_ready_warm_server(
+    create_server_mock,
+    assign_server_mock,
+    ready_warm_server,
+    dummy_active_server_type,
+    django_user_model,
+):
+    ready_warm_server.server_state = ServerState.CREATING.value
+    ready_warm_server.save()
+
+    user = django_user_model.objects.create(username='warm-user')
+    instance = ProvisionedServerInstance.objects.create(
+        server_type=dummy_active_server_type, user=user
+    )
+
+    create_server_mock.assert_called_once_with(instance_id=instance.id)
+    assign_server_mock.assert_not_called()
+    assert WarmServer.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_execution_trace_stored_once():
+    trace = 'Traceback:\n  <object at 0x{address}>\nValueError: {job_id}'
+    first = ExecutionTrace.record(
+        trace.format(address='7f01', job_id='5e3e0d4c-5c0e-4a8e-9d3c-2f4c7e0a1b2c')
+    )
+    second = ExecutionTrace.record(
+        trace.format(address='7f02', job_id='0b1c2d3e-4f50-6172-8394-a5b6c7d8e9f0')
+    )
+    ExecutionTrace.record('Traceback:\nKeyError')
+
+    assert second == first
+    assert ExecutionTrace.objects.count() == 2
+    first.refresh_from_db()
+    assert first.occurrences == 2
+    assert str(first).startswith('ValueError')
+
+
+@pytest.mark.django_db
+def test_failures_share_the_trace():
+    catcher = ErrorCatcher()
+    catcher.name = 'dummy-task'
+    for job_id in ['job-1', 'job-2']:
+        catcher.on_failure(
+            ValueError('down'), job_id, (), {}, 'Traceback:\nValueError: down'
+        )
+
+    trace = ExecutionTrace.objects.get()
+    assert trace.occurrences == 2
+    for message in ExecutionMessages.objects.all():
+        assert message.admin_trace is None
+        assert message.get_content('admin_trace') == trace.trace
+
+
+@pytest.mark.django_db
+@patch('server.models.tasks.create_server.delay')
+def test_one_active_server_per_type(
+    create_server_mock, dummy_provisioned_server_instance
+):
+    with pytest.raises(PermissionError):
+        ProvisionedServerInstance.objects.create(
+            server_type=dummy_provisioned_server_instance.server_type,
+            user=dummy_provisioned_server_instance.user,
+        )
+
+    # a server being removed does not count
+    dummy_provisioned_server_instance.server_bears_mark_of_deletion = True
+    dummy_provisioned_server_instance.save()
+    ProvisionedServerInstance.objects.create(
+        server_type=dummy_provisioned_server_instance.server_type,
+        user=dummy_provisioned_server_instance.user,
+    )
+    assert ProvisionedServerInstance.objects.count() == 2
+
+
+@pytest.mark.django_db
+@patch('server.models.tasks.create_server.delay')
+def test_superuser_may_have_several_servers_per_type(
+    create_server_mock, dummy_active_server_type, django_user_model
+):
+    superuser = django_user_model.objects.create(
+        username='super', is_superuser=True
+    )
+    for _ in range(2):
+        ProvisionedServerInstance.objects.create(
+            server_type=dummy_active_server_type, user=superuser
+        )
+    assert ProvisionedServerInstance.objects.count() == 2
+
+
+@pytest.mark.django_db
+@patch('server.models.tasks.create_server.delay')
+def test_other_integrity_errors_are_not_hidden(
+    create_server_mock, dummy_provisioned_server_instance
+):
+    instance = dummy_provisioned_server_instance
+    ProvisionedServerInstance.objects.filter(id=instance.id).update(
+        server_bears_mark_of_deletion=True
+    )
+    # not a second server of the type, but a duplicate primary key
+    with pytest.raises(IntegrityError):
+        ProvisionedServerInstance.objects.create(
+            id=instance.id,
+            server_type=instance.server_type,
+            user=instance.user,
+        )
+
+
+@pytest.mark.django_db
+@patch('server.models.tasks.schedule_due_jobs')
+@patch('server.models.tasks.create_server.delay')
+def test_creation_schedules_due_jobs_on_commit(
+    create_server_mock,
+    schedule_mock,
+    dummy_active_server_type,
+    django_user_model,
+    django_capture_on_commit_callbacks,
+):
+    user = django_user_model.objects.create(username='due-user')
+    with django_capture_on_commit_callbacks() as callbacks:
+        instance = ProvisionedServerInstance.objects.create(
+            server_type=dummy_active_server_type, user=user
+        )
+        schedule_mock.assert_not_called()
+
+    for callback in callbacks:
+        callback()
+    schedule_mock.assert_called_once_with(instance)
+
+
+@pytest.mark.django_db
+def test_has_group_permission(
+    dummy_active_server_type,
+    django_user_model,
+    django_assert_num_queries,
+    django_capture_on_commit_callbacks,
+):
+    user = django_user_model.objects.create(username='example')
+    assert dummy_active_server_type.has_group_permission(user)
+    # cached, shared with the create view
+    with django_assert_num_queries(0):
+        assert dummy_active_server_type.has_group_permission(user)
+    assert list(ServerType.get_user_choosable_option(user)) == [
+        dummy_active_server_type
+    ]
+
+    group = Group.objects.create(name='allowed')
+    with django_capture_on_commit_callbacks(execute=True):
+        dummy_active_server_type.allowed_groups.add(group)
+        # invalidated only on commit, not while the change is invisible
+        assert dummy_active_server_type.has_group_permission(user)
+    assert not dummy_active_server_type.has_group_permission(user)
+    assert not ServerType.get_user_choosable_option(user).exists()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        user.groups.add(group)
+    assert dummy_active_server_type.has_group_permission(user)
+
+    # no duplicates when the user shares several groups with the type
+    other_group = Group.objects.create(name='also-allowed')
+    with django_capture_on_commit_callbacks(execute=True):
+        dummy_active_server_type.allowed_groups.add(other_group)
+        user.groups.add(other_group)
+    assert list(ServerType.get_user_choosable_option(user)) == [
+        dummy_active_server_type
+    ]
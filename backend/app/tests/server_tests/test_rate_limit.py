@@ -0,0 +1,69 @@
+import pytest
+
+from django.core.cache import cache
+
+from server import rate_limit
+from server.rate_limit import TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, 'time', clock.time)
+    monkeypatch.setattr(rate_limit, 'sleep', clock.sleep)
+    yield clock
+    cache.clear()
+
+
+def test_token_bucket_waits_when_empty(clock):
+    bucket = TokenBucket('test-empty', capacity=2, refill_per_second=0.5)
+
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(2)
+    assert bucket.stats() == {
+        'calls': 3,
+        'waited_calls': 1,
+        'waited_seconds': pytest.approx(2),
+    }
+
+
+def test_token_bucket_is_shared_through_the_cache(clock):
+    bucket = TokenBucket('test-shared', capacity=1, refill_per_second=1)
+    other_process_bucket = TokenBucket(
+        'test-shared', capacity=1, refill_per_second=1
+    )
+
+    assert bucket.acquire() == 0
+    assert other_process_bucket.acquire() == pytest.approx(1)
+
+
+def test_token_bucket_follows_reported_quota(clock):
+    bucket = TokenBucket('test-quota', capacity=100, refill_per_second=1)
+
+    bucket.update_remaining(limit=50, remaining=0)
+    assert bucket.capacity == 50
+    assert bucket.acquire() == pytest.approx(1)
+
+
+def test_token_bucket_keeps_lock_taken_over_by_others(clock):
+    bucket = TokenBucket('test-lock', capacity=1, refill_per_second=1)
+
+    with bucket._locked():
+        # our lock timed out and another process took it
+        cache.set(bucket._lock_key, 'other', timeout=None)
+
+    assert cache.get(bucket._lock_key) == 'other'
@@ -1,4 +1,8 @@
-from server.server_registration import ServerState, ServerTypeFactory
+from server.server_registration import (
+    Capability,
+    ServerState,
+    ServerTypeFactory,
+)
 
 
 def test_registry_simple(dummy_server_type, dummy_server_created_info):
@@ -53,3 +57,27 @@ def test_registry_optional_methods(
 
     deletion_info = server.delete_server(model_instance_id=dummy_server_created_info.server_id)
     assert deletion_info.deleted == True
+
+
+def test_registry_shares_instances(dummy_server_type):
+    server = ServerTypeFactory.create_server_type(dummy_server_type)
+    assert ServerTypeFactory.create_server_type(dummy_server_type) is server
+
+
+def test_registry_capabilities(dummy_server_type, extended_dummy_server_type):
+    basic = Capability.CREATE | Capability.SERVER_INFO | Capability.DELETE
+    assert ServerTypeFactory.capabilities[dummy_server_type] == basic
+    assert ServerTypeFactory.capabilities[extended_dummy_server_type] == (
+        basic
+        | Capability.RESTART
+        | Capability.START
+        | Capability.STOP
+        | Capability.PW_RESET
+    )
+
+    actions = ServerTypeFactory.get_available_actions(dummy_server_type)
+    assert actions['is_deletable']
+    assert not actions['is_restartable']
+    assert ServerTypeFactory.get_available_actions(
+        extended_dummy_server_type
+    )['is_pw_resetable']
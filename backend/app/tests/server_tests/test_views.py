@@ -0,0 +1,256 @@
+from unittest.mock import patch
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from celery.result import GroupResult
+
+import pytest
+
+from server.models import (
+    EXECUTION_LOG_PAGE_SIZE,
+    ExecutionMessages,
+    ProvisionedServerInstance,
+)
+
+
+@pytest.fixture
+def superuser_client(client, django_user_model):
+    superuser = django_user_model.objects.create(
+        username='admin', is_superuser=True
+    )
+    client.force_login(superuser)
+    return client
+
+
+def _create_instances(server_type, django_user_model, count):
+    start = django_user_model.objects.count()
+    for i in range(start, start + count):
+        user = django_user_model.objects.create(username=f'user-{i}')
+        with patch('server.models.tasks.create_server.delay'):
+            instance = ProvisionedServerInstance.objects.create(
+                server_type=server_type, user=user, server_id=f'id-{i}'
+            )
+        ExecutionMessages.objects.create(
+            instance=instance,
+            job_id=f'job-{i}',
+            task_name='dummy-task',
+            user_message='A message',
+            admin_trace='A trace',
+        )
+
+
+def _count_queries(client, url):
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url)
+    assert response.status_code == 200
+    return len(queries)
+
+
+@pytest.mark.django_db
+def test_server_list_constant_queries(
+    superuser_client, dummy_active_server_type, django_user_model
+):
+    url = reverse('server:server-list')
+    _create_instances(dummy_active_server_type, django_user_model, 1)
+    queries_for_one = _count_queries(superuser_client, url)
+
+    _create_instances(dummy_active_server_type, django_user_model, 5)
+    assert _count_queries(superuser_client, url) == queries_for_one
+
+
+@pytest.mark.django_db
+def test_server_detail_constant_queries(
+    superuser_client, dummy_active_server_type, django_user_model
+):
+    _create_instances(dummy_active_server_type, django_user_model, 1)
+    instance = ProvisionedServerInstance.objects.get()
+    url = reverse('server:server-details', kwargs=dict(pk=instance.id))
+    queries_for_one = _count_queries(superuser_client, url)
+
+    for i in range(5):
+        ExecutionMessages.objects.create(
+            instance=instance,
+            job_id=f'another-job-{i}',
+            task_name='dummy-task',
+            user_message='Another message',
+            admin_trace='Another trace',
+        )
+    assert _count_queries(superuser_client, url) == queries_for_one
+
+
+@pytest.mark.django_db
+def test_server_detail_defers_log_content(
+    superuser_client, dummy_active_server_type, django_user_model
+):
+    _create_instances(dummy_active_server_type, django_user_model, 1)
+    instance = ProvisionedServerInstance.objects.get()
+    url = reverse('server:server-details', kwargs=dict(pk=instance.id))
+
+    response = superuser_client.get(url)
+    assert b'A message' not in response.content
+    assert b'A trace' not in response.content
+    log = response.context['server'].execution_log
+    assert len(log.user_messages) == 1
+    assert len(log.admin_traces) == 1
+    assert log.user_traces == log.admin_messages == []
+    assert log.next_entries == {}
+
+
+@pytest.mark.django_db
+def test_server_log_entry(
+    client, superuser_client, dummy_active_server_type, django_user_model
+):
+    _create_instances(dummy_active_server_type, django_user_model, 1)
+    instance = ProvisionedServerInstance.objects.get()
+    entry = ExecutionMessages.objects.get()
+    url = reverse(
+        'server:server-log-entry',
+        kwargs=dict(pk=instance.id, log_id='admin_traces', entry_id=entry.id),
+    )
+
+    response = superuser_client.get(url)
+    assert response.status_code == 200
+    assert b'A trace' in response.content
+
+    client.force_login(instance.user)
+    assert client.get(url).status_code == 404
+
+
+@pytest.mark.django_db
+def test_server_log_pages(
+    superuser_client, dummy_active_server_type, django_user_model
+):
+    _create_instances(dummy_active_server_type, django_user_model, 1)
+    instance = ProvisionedServerInstance.objects.get()
+    for i in range(4):
+        ExecutionMessages.objects.create(
+            instance=instance,
+            job_id=f'another-job-{i}',
+            task_name='dummy-task',
+            user_message='Another message',
+        )
+    ids = list(
+        ExecutionMessages.objects.order_by('-created', '-id').values_list(
+            'id', flat=True
+        )
+    )
+
+    page, next_entry = instance.execution_log_page('user_messages', None, 2)
+    assert [entry.id for entry in page] == ids[:2]
+    page, next_entry = instance.execution_log_page(
+        'user_messages', next_entry, 2
+    )
+    assert [entry.id for entry in page] == ids[2:4]
+    page, next_entry = instance.execution_log_page(
+        'user_messages', next_entry, 2
+    )
+    assert [entry.id for entry in page] == ids[4:]
+    assert next_entry is None
+
+    url = reverse(
+        'server:server-log',
+        kwargs=dict(pk=instance.id, log_id='user_messages'),
+    )
+    response = superuser_client.get(url, {'before': ids[0]})
+    assert response.status_code == 200
+    assert [entry.id for entry in response.context['logs']] == ids[1:]
+
+    assert superuser_client.get(url, {'before': 'x'}).status_code == 404
+
+
+@pytest.mark.django_db
+def test_server_detail_pages_only_streams_with_older_entries(
+    superuser_client, dummy_active_server_type, django_user_model
+):
+    _create_instances(dummy_active_server_type, django_user_model, 1)
+    instance = ProvisionedServerInstance.objects.get()
+    for i in range(EXECUTION_LOG_PAGE_SIZE):
+        ExecutionMessages.objects.create(
+            instance=instance,
+            job_id=f'another-job-{i}',
+            task_name='dummy-task',
+            user_message='Another message',
+        )
+    url = reverse('server:server-details', kwargs=dict(pk=instance.id))
+
+    response = superuser_client.get(url)
+    log = response.context['server'].execution_log
+    # the first entry has the only admin trace, it is on the next page
+    assert list(log.next_entries) == ['user_messages', 'admin_traces']
+    assert response.content.count(b'class="log-more"') == 2
+
+
+@pytest.mark.django_db
+def test_server_create_twice(client, dummy_provisioned_server_instance):
+    client.force_login(dummy_provisioned_server_instance.user)
+    url = reverse('server:server-add')
+
+    with patch('server.models.tasks.create_server.delay') as create_mock:
+        response = client.post(
+            url,
+            {'server_type': dummy_provisioned_server_instance.server_type_id},
+        )
+    assert response.status_code == 200
+    assert response.context['form'].errors['server_type'] == [
+        'You already have a server of this type.'
+    ]
+    create_mock.assert_not_called()
+    assert ProvisionedServerInstance.objects.count() == 1
+
+
+@pytest.mark.django_db
+@patch('server.tasks._send_bulk_job')
+def test_server_bulk_action(
+    send_mock,
+    client,
+    superuser_client,
+    dummy_active_server_type,
+    django_user_model,
+    django_capture_on_commit_callbacks,
+):
+    from django_celery_results.models import TaskResult
+
+    _create_instances(dummy_active_server_type, django_user_model, 3)
+    instance_ids = list(
+        ProvisionedServerInstance.objects.values_list('id', flat=True)
+    )
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = superuser_client.post(
+            reverse('server:server-bulk'),
+            {'action': 'reboot', 'instance_ids': instance_ids},
+        )
+    assert response.status_code == 200
+    assert send_mock.call_count == 3
+    progress_url = response.json()['progress_url']
+
+    progress = superuser_client.get(progress_url).json()
+    assert progress['complete'] is False
+    assert progress['progress']['total'] == 3
+
+    group = GroupResult.restore(response.json()['group_id'])
+    for job in group.results:
+        TaskResult.objects.store_result(
+            'application/json', 'utf-8', job.id, '{}', 'SUCCESS'
+        )
+    progress = superuser_client.get(progress_url).json()
+    assert progress['complete'] is True
+    assert progress['result'] == {'succeeded': 3, 'failed': 0}
+
+    assert superuser_client.post(
+        reverse('server:server-bulk'),
+        {'action': 'unknown', 'instance_ids': instance_ids},
+    ).status_code == 400
+    assert superuser_client.post(
+        reverse('server:server-bulk'),
+        {'action': 'reboot', 'instance_ids': ['x']},
+    ).status_code == 400
+
+    # superuser_client is the same client, logged in again
+    client.force_login(ProvisionedServerInstance.objects.first().user)
+    assert client.post(
+        reverse('server:server-bulk'),
+        {'action': 'reboot', 'instance_ids': instance_ids},
+    ).status_code == 403